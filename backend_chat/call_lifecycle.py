@@ -0,0 +1,156 @@
+import math
+import time
+
+RINGING = 'ringing'
+ACCEPTED = 'accepted'
+REJECTED = 'rejected'
+MISSED = 'missed'
+ENDED = 'ended'
+
+# ringing -> accepted/rejected/missed, accepted -> ended; the rest are final
+TRANSITIONS = {
+    RINGING: {ACCEPTED, REJECTED, MISSED},
+    ACCEPTED: {ENDED},
+}
+
+
+class TimerWheel:
+    """Hashed timing wheel: O(1) schedule and cancel, one slot visited per tick.
+
+    A timer due in ``n`` ticks lands in slot ``(cursor + n) % slots`` with
+    ``(n - 1) // slots`` extra revolutions to wait. Each tick only looks at
+    the slot under the cursor, so its cost depends on how many timers are due
+    (plus long timers passing through), not on how many are pending.
+    """
+
+    def __init__(self, tick, slots, now):
+        self.tick = tick
+        self._slots = [{} for _ in range(slots)]
+        self._slot_of = {}
+        self._cursor = 0
+        self._time = now
+
+    def __len__(self):
+        return len(self._slot_of)
+
+    def schedule(self, key, delay):
+        self.cancel(key)
+        ticks = max(1, math.ceil(delay / self.tick))
+        slot = (self._cursor + ticks) % len(self._slots)
+        self._slots[slot][key] = (ticks - 1) // len(self._slots)
+        self._slot_of[key] = slot
+
+    def cancel(self, key):
+        slot = self._slot_of.pop(key, None)
+        if slot is not None:
+            del self._slots[slot][key]
+
+    def advance(self, now):
+        """Turn the wheel up to ``now``; returns the keys whose timers fired."""
+        fired = []
+        while self._time + self.tick <= now:
+            self._time += self.tick
+            self._cursor = (self._cursor + 1) % len(self._slots)
+            bucket = self._slots[self._cursor]
+            for key, rounds in list(bucket.items()):
+                if rounds:
+                    bucket[key] = rounds - 1
+                else:
+                    del bucket[key]
+                    del self._slot_of[key]
+                    fired.append(key)
+        return fired
+
+
+class CallState:
+    __slots__ = ('call_uuid', 'caller_id', 'receiver_id', 'caller_sid', 'call_type', 'status')
+
+    def __init__(self, call_uuid, caller_id, receiver_id, caller_sid, call_type):
+        self.call_uuid = call_uuid
+        self.caller_id = caller_id
+        self.receiver_id = receiver_id
+        self.caller_sid = caller_sid
+        self.call_type = call_type
+        self.status = RINGING
+
+
+class CallTracker:
+    """Live calls on this worker, each with a deadline for its current state.
+
+    A ringing call that nobody answers within ``ring_timeout`` seconds, and an
+    accepted call still open after ``max_duration``, is handed to
+    ``on_expire`` from a background loop that turns a timer wheel once per
+    ``tick``. Final states (rejected, missed, ended) drop the call from memory.
+    """
+
+    def __init__(self, ring_timeout, max_duration, on_expire, spawn, sleep, tick=1.0, slots=4096,
+                 clock=time.monotonic):
+        self.ring_timeout = ring_timeout
+        self.max_duration = max_duration
+        self.tick = tick
+        self._on_expire = on_expire
+        self._spawn = spawn
+        self._sleep = sleep
+        self._clock = clock
+        self._wheel = TimerWheel(tick, slots, clock())
+        self._calls = {}
+
+    def __len__(self):
+        return len(self._calls)
+
+    def __contains__(self, call_uuid):
+        return call_uuid in self._calls
+
+    def get(self, call_uuid):
+        return self._calls.get(call_uuid)
+
+    def count(self, status):
+        return sum(1 for state in self._calls.values() if state.status == status)
+
+    def ring(self, call_uuid, caller_id, receiver_id, caller_sid, call_type):
+        state = self._calls[call_uuid] = CallState(call_uuid, caller_id, receiver_id, caller_sid, call_type)
+        self._wheel.schedule(call_uuid, self.ring_timeout)
+        return state
+
+    def adopt(self, call_uuid, caller_id, receiver_id, call_type, status):
+        """Track a call that reached ``status`` on another worker."""
+        state = self._calls.get(call_uuid)
+        if state is None:
+            state = self._calls[call_uuid] = CallState(call_uuid, caller_id, receiver_id, None, call_type)
+        self._enter(state, status)
+        return state
+
+    def transition(self, call_uuid, status):
+        """Move a tracked call to ``status``; None if it is unknown or the move is not allowed."""
+        state = self._calls.get(call_uuid)
+        if state is None or status not in TRANSITIONS.get(state.status, ()):
+            return None
+        self._enter(state, status)
+        return state
+
+    def remove(self, call_uuid):
+        self._wheel.cancel(call_uuid)
+        return self._calls.pop(call_uuid, None)
+
+    def _enter(self, state, status):
+        state.status = status
+        if status == RINGING:
+            self._wheel.schedule(state.call_uuid, self.ring_timeout)
+        elif status == ACCEPTED:
+            self._wheel.schedule(state.call_uuid, self.max_duration)
+        else:
+            self.remove(state.call_uuid)
+
+    def start(self):
+        self._spawn(self._run)
+
+    def _run(self):
+        while True:
+            self._sleep(self.tick)
+            self.expire_due()
+
+    def expire_due(self):
+        for call_uuid in self._wheel.advance(self._clock()):
+            state = self._calls.get(call_uuid)
+            if state is not None:
+                self._on_expire(state)
@@ -0,0 +1,129 @@
+import atexit
+import logging
+import os
+import queue
+import socket
+import time
+
+import socketio
+
+logger = logging.getLogger(__name__)
+
+
+class InProcessManager(socketio.PubSubManager):
+    """Pub/sub over an in-memory hub shared by every server in this process.
+
+    Stand-in for Redis when several ``SocketIO`` servers live in one process,
+    e.g. in tests. Messages are JSON-encoded on publish like the real
+    backends, so payloads that would not survive Redis fail here too.
+    """
+    name = 'memory'
+    _hubs = {}
+
+    def __init__(self, url='memory://', channel='socketio', write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self._inbox = queue.Queue()
+        subscribers = self._hubs.setdefault(channel, [])
+        if not write_only:
+            subscribers.append(self._inbox)
+
+    def _publish(self, data):
+        message = self.json.dumps(data)
+        for inbox in self._hubs.get(self.channel, []):
+            if inbox is not self._inbox:
+                inbox.put(message)
+
+    def _listen(self):
+        while True:
+            yield self._inbox.get()
+
+
+class UnixSocketManager(socketio.PubSubManager):
+    """Pub/sub between worker processes on one host over Unix datagram sockets.
+
+    Every listening worker binds ``<directory>/<channel>/<host_id>.sock`` and
+    publishing sends one datagram to each socket found there, so no broker
+    process is needed. A single emit must fit in the socket buffer
+    (``MAX_MESSAGE_SIZE``); use Redis for larger payloads or more than one host.
+    """
+    name = 'unix'
+    MAX_MESSAGE_SIZE = 4 * 1024 * 1024
+    PEER_REFRESH_INTERVAL = 1.0
+
+    def __init__(self, url, channel='socketio', write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.directory = os.path.join(url[len('unix://'):], channel)
+        os.makedirs(self.directory, exist_ok=True)
+        self.path = os.path.join(self.directory, f"{self.host_id}.sock")
+        self._sender = self._make_socket()
+        self._listener = None
+        self._peers = []
+        self._peers_loaded_at = 0.0
+
+    def _make_socket(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.MAX_MESSAGE_SIZE)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.MAX_MESSAGE_SIZE)
+        return sock
+
+    def initialize(self):
+        if not self.write_only:
+            # Bind before the listener thread starts so no early publish is lost
+            self._listener = self._make_socket()
+            self._listener.bind(self.path)
+            atexit.register(self._unlink)
+        super().initialize()
+
+    def _unlink(self):
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def _current_peers(self):
+        now = time.monotonic()
+        if now - self._peers_loaded_at > self.PEER_REFRESH_INTERVAL:
+            self._peers = [
+                os.path.join(self.directory, name)
+                for name in os.listdir(self.directory)
+                if name.endswith('.sock')
+            ]
+            self._peers_loaded_at = now
+        return self._peers
+
+    def _publish(self, data):
+        message = self.json.dumps(data).encode('utf-8')
+        for path in self._current_peers():
+            if path == self.path:
+                continue
+            try:
+                self._sender.sendto(message, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Socket file left behind by a worker that died without cleanup
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                self._peers_loaded_at = 0.0
+            except OSError as e:
+                logger.error(f"❌ Could not publish {len(message)} bytes to {path}: {e}")
+
+    def _listen(self):
+        while True:
+            yield self._listener.recv(self.MAX_MESSAGE_SIZE).decode('utf-8')
+
+
+def queue_options(url, channel='flask-socketio'):
+    """SocketIO keyword arguments for the message queue at ``url``.
+
+    ``memory://`` and ``unix:///some/dir`` use the managers above; any other
+    URL (``redis://``, ``amqp://``, ``kafka://``, ...) is handed to
+    Flask-SocketIO, which picks the matching backend itself.
+    """
+    if not url:
+        return {}
+    if url.startswith('memory://'):
+        return {'client_manager': InProcessManager(url, channel=channel)}
+    if url.startswith('unix://'):
+        return {'client_manager': UnixSocketManager(url, channel=channel)}
+    return {'message_queue': url, 'channel': channel}
@@ -0,0 +1,93 @@
+import json
+from collections import OrderedDict
+
+
+class TailEntry:
+    __slots__ = ('messages', 'sizes', 'size', 'complete')
+
+    def __init__(self, messages, complete):
+        self.messages = list(messages)
+        self.sizes = [_estimate_size(m) for m in self.messages]
+        self.size = sum(self.sizes)
+        # True when the entry holds the whole conversation, not just its tail
+        self.complete = complete
+
+    @property
+    def last_id(self):
+        return self.messages[-1]['id'] if self.messages else 0
+
+
+def _estimate_size(message):
+    return len(json.dumps(message, ensure_ascii=False))
+
+
+class ConversationTailCache:
+    """LRU of the newest ``tail_size`` serialized messages per conversation.
+
+    Bounded by the total (approximate JSON) size of the cached messages;
+    the least recently used conversations are evicted first. Entries are
+    only ever extended by ``append`` once loaded, so the cache must be fed
+    every message the process commits.
+    """
+
+    def __init__(self, max_bytes, tail_size):
+        self.max_bytes = max_bytes
+        self.tail_size = tail_size
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size(self):
+        return self._bytes
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key, messages, complete):
+        self._remove(key)
+        entry = TailEntry(messages[-self.tail_size:], complete and len(messages) <= self.tail_size)
+        self._entries[key] = entry
+        self._bytes += entry.size
+        self._evict()
+        return entry
+
+    def append(self, key, message):
+        entry = self._entries.get(key)
+        if entry is None:
+            # Not loaded; the next read fetches it from the database
+            return
+        if entry.messages and message['id'] <= entry.last_id:
+            return
+        size = _estimate_size(message)
+        entry.messages.append(message)
+        entry.sizes.append(size)
+        entry.size += size
+        self._bytes += size
+        while len(entry.messages) > self.tail_size:
+            entry.messages.pop(0)
+            dropped = entry.sizes.pop(0)
+            entry.size -= dropped
+            self._bytes -= dropped
+            entry.complete = False
+        self._evict()
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._entries:
+            _, entry = self._entries.popitem(last=False)
+            self._bytes -= entry.size
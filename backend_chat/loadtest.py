@@ -0,0 +1,448 @@
+"""Socket.IO load simulation for backend_chat.
+
+Starts the chat server on a free local port against a throwaway database
+and connects ``--clients`` simulated users, paired into conversations. For
+``--duration`` seconds every pair exchanges messages and typing bursts and
+runs full calls (call_request -> call_response -> join_call_room ->
+offer/answer/ICE -> end_call). Reports delivery latency percentiles per
+event kind, events/sec and server RSS growth per connection, and saves
+them as JSON:
+
+    python loadtest.py --clients 1000 --duration 30 --output base.json
+    python loadtest.py --clients 1000 --duration 30 --baseline base.json --tolerance 15
+
+With --baseline the run exits 1 when a p95 latency, the received event
+rate or memory per connection is more than --tolerance percent worse.
+Clients run as green threads in this process, so on a small machine the
+client side competes with the server for CPU; compare runs made on the
+same machine with the same settings.
+"""
+import eventlet
+eventlet.monkey_patch()
+
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+
+import requests
+import socketio
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FAKE_SDP = 'v=0\r\no=- 0 0 IN IP4 127.0.0.1\r\ns=-\r\n' + 'a=candidate:0 1 UDP 2122252543 10.0.0.1 50000 typ host\r\n' * 20
+LATENCY_KINDS = ('message', 'typing', 'call_setup', 'offer', 'answer', 'ice')
+
+
+class Stats:
+    def __init__(self):
+        self.recording = False
+        self.latencies = defaultdict(list)
+        self.sent = Counter()
+        self.received = Counter()
+        self.errors = Counter()
+
+    def latency(self, kind, started):
+        if self.recording:
+            self.latencies[kind].append(time.monotonic() - started)
+
+
+class Pair:
+    """State shared by the two clients of one conversation."""
+
+    def __init__(self):
+        self.typing_started = {}
+        self.call_started = None
+        self.ready_call = None
+
+
+class SimClient:
+    def __init__(self, user_id, peer_id, is_caller, pair, args, stats, rng):
+        self.user_id = user_id
+        self.peer_id = peer_id
+        self.is_caller = is_caller
+        self.pair = pair
+        self.args = args
+        self.stats = stats
+        self.rng = rng
+        self.sio = socketio.Client(reconnection=False)
+        for event in ('receive_message', 'typing', 'incoming_call', 'call_response', 'call_room_ready',
+                      'webrtc_offer', 'webrtc_answer', 'webrtc_ice_candidate', 'webrtc_ice_candidates',
+                      'call_ended', 'call_failed', 'error'):
+            self.sio.on(event, self._counted(event, getattr(self, f'on_{event}')))
+        self.sio.on('disconnect', self.on_disconnect)
+
+    def _counted(self, event, handler):
+        def wrapper(data):
+            if self.stats.recording:
+                self.stats.received[event] += 1
+            handler(data)
+        return wrapper
+
+    def emit(self, event, data):
+        if self.stats.recording:
+            self.stats.sent[event] += 1
+        try:
+            self.sio.emit(event, data)
+        except socketio.exceptions.BadNamespaceError:
+            self.stats.errors['emit_while_disconnected'] += 1
+
+    def connect(self, url):
+        query = f'userId={self.user_id}' + ('&iceBatch=1' if self.args.ice_batch_ms else '')
+        self.sio.connect(f'{url}?{query}', transports=['websocket'], wait_timeout=30)
+        self.emit('join', {'sender_id': self.user_id, 'receiver_id': self.peer_id})
+
+    # Driver
+
+    def run(self, deadline):
+        args, rng = self.args, self.rng
+        now = time.monotonic()
+        due = {
+            'message': now + rng.uniform(0, args.message_interval),
+            'typing': now + rng.uniform(0, args.typing_interval),
+        }
+        if self.is_caller and args.call_interval:
+            due['call'] = now + rng.uniform(0, args.call_interval)
+        while True:
+            action, at = min(due.items(), key=lambda item: item[1])
+            if at >= deadline:
+                return
+            time.sleep(max(0, at - time.monotonic()))
+            if not self.sio.connected:
+                return
+            getattr(self, f'do_{action}')()
+            due[action] = at + getattr(args, f'{action}_interval')
+
+    def do_message(self):
+        self.emit('send_message', {
+            'sender_id': self.user_id,
+            'receiver_id': self.peer_id,
+            'message': f'{time.monotonic():.6f} ' + 'x' * self.args.message_size
+        })
+
+    def do_typing(self):
+        self.pair.typing_started[self.user_id] = time.monotonic()
+        for _ in range(self.args.typing_keystrokes):
+            self.emit('typing', {'sender_id': self.user_id, 'receiver_id': self.peer_id, 'typing': True})
+            time.sleep(0.05)
+        self.emit('typing', {'sender_id': self.user_id, 'receiver_id': self.peer_id, 'typing': False})
+
+    def do_call(self):
+        if self.pair.call_started is not None:
+            # Previous call still running
+            return
+        self.pair.call_started = time.monotonic()
+        self.emit('call_request', {'from': self.user_id, 'to': self.peer_id, 'type': 'video'})
+
+    def send_ice(self, call_uuid):
+        for n in range(self.args.ice_candidates):
+            self.emit('webrtc_ice_candidate', {
+                'from': self.user_id, 'to': self.peer_id, 'call_uuid': call_uuid,
+                # Send time rides inside the candidate, the only part kept in batches
+                'candidate': {'candidate': f'candidate:{n} 1 UDP 2122252543 10.0.0.1 {50000 + n} typ host',
+                              'sdpMid': '0', 'sdpMLineIndex': 0, 't': time.monotonic()}
+            })
+
+    def end_call(self, call_uuid):
+        if self.sio.connected:
+            self.emit('end_call', {'call_uuid': call_uuid, 'from': self.user_id, 'to': self.peer_id})
+
+    # Handlers
+
+    def on_receive_message(self, data):
+        if data.get('receiver_id') == self.user_id:
+            self.stats.latency('message', float(data['message'].split(' ', 1)[0]))
+
+    def on_typing(self, data):
+        started = self.pair.typing_started.pop(self.peer_id, None)
+        if data.get('typing') and started is not None:
+            self.stats.latency('typing', started)
+
+    def on_incoming_call(self, data):
+        self.emit('call_response', {
+            'from': self.user_id, 'to': data['from'], 'call_uuid': data['call_uuid'], 'action': 'accept'
+        })
+        self.emit('join_call_room', {'call_uuid': data['call_uuid'], 'user_id': self.user_id})
+
+    def on_call_response(self, data):
+        if data.get('action') == 'accept':
+            self.emit('join_call_room', {'call_uuid': data['call_uuid'], 'user_id': self.user_id})
+        else:
+            self.pair.call_started = None
+
+    def on_call_room_ready(self, data):
+        # Sent once per join_call_room; the caller starts negotiating on the first
+        if not self.is_caller or self.pair.ready_call == data['call_uuid']:
+            return
+        self.pair.ready_call = data['call_uuid']
+        if self.pair.call_started is not None:
+            self.stats.latency('call_setup', self.pair.call_started)
+        self.emit('webrtc_offer', {
+            'from': self.user_id, 'to': self.peer_id, 'call_uuid': data['call_uuid'],
+            'sdp': {'type': 'offer', 'sdp': FAKE_SDP}, 't': time.monotonic()
+        })
+
+    def on_webrtc_offer(self, data):
+        self.stats.latency('offer', data['t'])
+        self.emit('webrtc_answer', {
+            'from': self.user_id, 'to': self.peer_id, 'call_uuid': data['call_uuid'],
+            'sdp': {'type': 'answer', 'sdp': FAKE_SDP}, 't': time.monotonic()
+        })
+        self.send_ice(data['call_uuid'])
+
+    def on_webrtc_answer(self, data):
+        self.stats.latency('answer', data['t'])
+        self.send_ice(data['call_uuid'])
+        timer = threading.Timer(self.args.call_hold, self.end_call, args=(data['call_uuid'],))
+        timer.daemon = True
+        timer.start()
+
+    def on_webrtc_ice_candidate(self, data):
+        self.stats.latency('ice', data['candidate']['t'])
+
+    def on_webrtc_ice_candidates(self, data):
+        for candidate in data['candidates']:
+            self.stats.latency('ice', candidate['t'])
+
+    def on_call_ended(self, data):
+        if self.is_caller:
+            self.pair.call_started = None
+
+    def on_call_failed(self, data):
+        self.stats.errors['call_failed'] += 1
+        self.pair.call_started = None
+
+    def on_disconnect(self, *args):
+        if self.stats.recording:
+            self.stats.errors['disconnected'] += 1
+
+    def on_error(self, data):
+        self.stats.errors[data.get('message', 'error')] += 1
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def rss_kb(pid):
+    try:
+        with open(f'/proc/{pid}/status') as fh:
+            for line in fh:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def start_server(args, db_path, port, log):
+    env = dict(os.environ, CHAT_DATABASE_URL=f'sqlite:///{db_path}', CHAT_PORT=str(port))
+    env.setdefault('CHAT_LOG_LEVEL', 'WARNING')
+    if args.ice_batch_ms:
+        env['CHAT_ICE_COALESCE_MS'] = str(args.ice_batch_ms)
+    proc = subprocess.Popen([sys.executable, 'main.py'], cwd=HERE, env=env, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + args.startup_timeout
+    while time.monotonic() < deadline and proc.poll() is None:
+        try:
+            requests.get(f'http://127.0.0.1:{port}/health', timeout=1)
+            return proc
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    proc.terminate()
+    log.seek(0)
+    raise RuntimeError(f'server failed to start:\n{log.read()}')
+
+
+def percentile(values, fraction):
+    return round(values[min(len(values) - 1, int(len(values) * fraction))] * 1000, 2)
+
+
+def summarize_latency(stats):
+    summary = {}
+    for kind in LATENCY_KINDS:
+        values = sorted(stats.latencies.get(kind, ()))
+        if values:
+            summary[kind] = {
+                'count': len(values),
+                'p50_ms': percentile(values, 0.50),
+                'p95_ms': percentile(values, 0.95),
+                'p99_ms': percentile(values, 0.99),
+                'max_ms': round(values[-1] * 1000, 2),
+            }
+    return summary
+
+
+def regressions(report, baseline, tolerance):
+    """Human-readable list of metrics more than ``tolerance`` percent worse than ``baseline``."""
+    found = []
+
+    def check(name, before, after, higher_is_worse=True):
+        if not before or after is None:
+            return
+        change = (after - before) / before * 100
+        if (change if higher_is_worse else -change) > tolerance:
+            found.append(f'{name}: {before} -> {after} ({change:+.1f}%)')
+
+    for kind, stats in report['latency'].items():
+        before = baseline.get('latency', {}).get(kind)
+        if before:
+            check(f'{kind} p95_ms', before['p95_ms'], stats['p95_ms'])
+    check('received events/sec', baseline['events_per_sec']['received'],
+          report['events_per_sec']['received'], higher_is_worse=False)
+    check('rss_per_connection_kb', baseline.get('rss_per_connection_kb'), report['rss_per_connection_kb'])
+    return found
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(report):
+    print(f"clients {report['connected']}/{report['settings']['clients']} connected, "
+          f"{report['events_per_sec']['sent']} events/s sent, {report['events_per_sec']['received']} received")
+    print(f"{'kind':<11} {'count':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for kind, stats in report['latency'].items():
+        print(f"{kind:<11} {stats['count']:>7} {stats['p50_ms']:>8} {stats['p95_ms']:>8} "
+              f"{stats['p99_ms']:>8} {stats['max_ms']:>8}")
+    print(f"server RSS {report['server_rss_kb']}, {report['rss_per_connection_kb']} KiB per connection")
+    if report['errors']:
+        print(f"errors {report['errors']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Socket.IO load simulation for backend_chat.')
+    parser.add_argument('--clients', type=int, default=200, help='simulated users (paired)')
+    parser.add_argument('--duration', type=float, default=20, help='measured seconds')
+    parser.add_argument('--warmup', type=float, default=3, help='seconds excluded from the results')
+    parser.add_argument('--message-interval', type=float, default=2.0, help='seconds between messages per client')
+    parser.add_argument('--message-size', type=int, default=100)
+    parser.add_argument('--typing-interval', type=float, default=5.0, help='seconds between typing bursts')
+    parser.add_argument('--typing-keystrokes', type=int, default=5)
+    parser.add_argument('--call-interval', type=float, default=10.0,
+                        help='seconds between calls per pair (0 disables calls)')
+    parser.add_argument('--call-hold', type=float, default=2.0, help='seconds a call stays up')
+    parser.add_argument('--ice-candidates', type=int, default=8, help='ICE candidates per side per call')
+    parser.add_argument('--ice-batch-ms', type=int, default=0,
+                        help='enable ICE batching with this CHAT_ICE_COALESCE_MS')
+    parser.add_argument('--connect-concurrency', type=int, default=50)
+    parser.add_argument('--startup-timeout', type=float, default=30)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default=None, help='JSON results file (default loadtest-<timestamp>.json)')
+    parser.add_argument('--baseline', default=None, help='earlier JSON results; exit 1 on regression')
+    parser.add_argument('--tolerance', type=float, default=10.0, help='allowed regression in percent')
+    args = parser.parse_args()
+    if args.clients < 2 or args.clients % 2:
+        parser.error('--clients must be an even number >= 2')
+
+    raise_fd_limit()
+    rng = random.Random(args.seed)
+    stats = Stats()
+    clients = []
+    for first in range(1, args.clients + 1, 2):
+        pair = Pair()
+        clients.append(SimClient(first, first + 1, True, pair, args, stats, random.Random(rng.random())))
+        clients.append(SimClient(first + 1, first, False, pair, args, stats, random.Random(rng.random())))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        port = free_port()
+        url = f'http://127.0.0.1:{port}'
+        with open(os.path.join(tmp, 'server.log'), 'w+') as log:
+            server = start_server(args, os.path.join(tmp, 'chat.db'), port, log)
+            try:
+                rss_idle = rss_kb(server.pid)
+                connect_failures = Counter()
+
+                def connect(client):
+                    try:
+                        client.connect(url)
+                    except Exception as e:
+                        connect_failures[type(e).__name__] += 1
+
+                pool = eventlet.GreenPool(args.connect_concurrency)
+                for _ in pool.imap(connect, clients):
+                    pass
+                connected = [client for client in clients if client.sio.connected]
+                time.sleep(1)
+                rss_connected = rss_kb(server.pid)
+
+                start = time.monotonic()
+                deadline = start + args.warmup + args.duration
+                eventlet.spawn_after(args.warmup, setattr, stats, 'recording', True)
+                drivers = [eventlet.spawn(client.run, deadline) for client in connected]
+                for driver in drivers:
+                    driver.wait()
+                stats.recording = False
+                rss_end = rss_kb(server.pid)
+
+                for _ in pool.imap(lambda client: client.sio.disconnect(), connected):
+                    pass
+            finally:
+                server.terminate()
+                server.wait(timeout=10)
+
+    per_connection = None
+    if rss_idle and rss_connected and connected:
+        per_connection = round((rss_connected - rss_idle) / len(connected), 1)
+    report = {
+        'started_at': datetime.now(timezone.utc).isoformat(),
+        'git_revision': git_revision(),
+        'python': platform.python_version(),
+        'settings': {
+            key: value for key, value in vars(args).items() if key not in ('output', 'baseline', 'tolerance')
+        },
+        'env': {k: v for k, v in os.environ.items() if k.startswith('CHAT_')},
+        'connected': len(connected),
+        'connect_failures': dict(connect_failures),
+        'events_per_sec': {
+            'sent': round(sum(stats.sent.values()) / args.duration, 1),
+            'received': round(sum(stats.received.values()) / args.duration, 1),
+        },
+        'events_sent': dict(stats.sent),
+        'events_received': dict(stats.received),
+        'latency': summarize_latency(stats),
+        'server_rss_kb': {'idle': rss_idle, 'connected': rss_connected, 'end': rss_end},
+        'rss_per_connection_kb': per_connection,
+        'errors': dict(stats.errors),
+    }
+    print_report(report)
+
+    output = args.output or f"loadtest-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    with open(output, 'w') as fh:
+        json.dump(report, fh, indent=2)
+    print(f'results saved to {output}')
+
+    if args.baseline:
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)
+        if baseline.get('settings') != report['settings']:
+            print('warning: baseline was recorded with different settings')
+        found = regressions(report, baseline, args.tolerance)
+        for line in found:
+            print(f'REGRESSION {line}')
+        if found:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
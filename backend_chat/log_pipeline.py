@@ -0,0 +1,96 @@
+import atexit
+import importlib
+import logging
+import random
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+EVENT_LOGGER_PREFIX = "chat.events"
+TEXT_FORMAT = "%(levelname)s:%(name)s:%(message)s"
+JSON_FORMAT = "%(asctime)s %(levelname)s %(name)s %(event)s %(message)s"
+
+
+def _native(module_name):
+    # Under eventlet the stdlib threading/queue modules are green; the listener
+    # needs a real OS thread so slow stream writes never block the hub.
+    try:
+        from eventlet import patcher
+    except ImportError:
+        return importlib.import_module(module_name)
+    return patcher.original(module_name)
+
+
+class NativeQueueListener(QueueListener):
+    def start(self):
+        self._thread = _native('threading').Thread(target=self._monitor, daemon=True)
+        self._thread.start()
+
+
+class EventSampler(logging.Filter):
+    """Tags records with their Socket.IO event and keeps a random share of them.
+
+    Warnings and errors are never sampled out.
+    """
+
+    def __init__(self, event, rate=1.0):
+        super().__init__()
+        self.event = event
+        self.rate = rate
+
+    def filter(self, record):
+        record.event = self.event
+        if record.levelno >= logging.WARNING or self.rate >= 1.0:
+            return True
+        return random.random() < self.rate
+
+
+def parse_event_spec(spec):
+    """Parse ``"typing=WARNING,webrtc_ice_candidate=INFO@0.05"`` into
+    ``{event: (level, rate)}``."""
+    settings = {}
+    for item in filter(None, (part.strip() for part in (spec or '').split(','))):
+        event, _, value = item.partition('=')
+        level, _, rate = value.partition('@')
+        settings[event.strip()] = (level.strip().upper() or 'INFO', float(rate) if rate else 1.0)
+    return settings
+
+
+def event_logger(event):
+    return logging.getLogger(f"{EVENT_LOGGER_PREFIX}.{event}")
+
+
+def configure_event_loggers(settings):
+    for event, (level, rate) in settings.items():
+        log = event_logger(event)
+        log.setLevel(level)
+        for existing in [f for f in log.filters if isinstance(f, EventSampler)]:
+            log.removeFilter(existing)
+        log.addFilter(EventSampler(event, rate))
+
+
+def _json_formatter():
+    from pythonjsonlogger import jsonlogger
+    return jsonlogger.JsonFormatter(JSON_FORMAT)
+
+
+def setup_logging(level=logging.INFO, json_output=False, event_settings=None):
+    """Route all logging through a queue drained by a background thread.
+
+    Returns the started listener; it is stopped (and the queue flushed) at exit.
+    """
+    log_queue = _native('queue').SimpleQueue()
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(_json_formatter() if json_output else logging.Formatter(TEXT_FORMAT))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(QueueHandler(log_queue))
+    root.setLevel(level)
+
+    configure_event_loggers(event_settings or {})
+
+    listener = NativeQueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -1,40 +1,152 @@
 import eventlet
 eventlet.monkey_patch()
 
-from flask import Flask, request, jsonify
-from flask_sqlalchemy import SQLAlchemy
-from flask_jwt_extended import JWTManager
+import click
+from flask import Flask, Response, request, jsonify
+from flask_jwt_extended import JWTManager, decode_token
 from flask_cors import CORS
-from flask_socketio import SocketIO, join_room, emit, leave_room
+from flask_socketio import join_room, emit, leave_room, disconnect
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import OperationalError
 from datetime import datetime, timezone, timedelta
+import atexit
+import functools
+import hmac
+import itertools
+import json
 import logging
+import os
+import signal
+import tempfile
 import uuid
 
-logging.basicConfig(level=logging.INFO)
+import fanout
+from call_lifecycle import ACCEPTED, ENDED, MISSED, REJECTED, RINGING, CallTracker
+from history_cache import ConversationTailCache
+import log_pipeline
+import message_search
+import metrics
+import persistence
+from presence import PresenceRegistry
+import profiler
+from signaling import IceCoalescer
+from socket_auth import SocketAuth
+from socket_metrics import InstrumentedSocketIO
+from typing_indicators import TypingTracker
+from write_pipeline import GroupCommitWriter
+
+# LOGGING
+# Records go through a queue drained by a background thread. Chatty socket
+# events log through per-event loggers with their own level and sample rate;
+# CHAT_LOG_EVENTS overrides these, e.g. "typing=DEBUG,webrtc_ice_candidate=INFO@0.05".
+DEFAULT_EVENT_LOGGING = (
+    "webrtc_ice_candidate=WARNING,typing=WARNING,"
+    "webrtc_offer=INFO,webrtc_answer=INFO,send_message=INFO@0.1"
+)
+event_log_settings = log_pipeline.parse_event_spec(DEFAULT_EVENT_LOGGING)
+event_log_settings.update(log_pipeline.parse_event_spec(os.environ.get('CHAT_LOG_EVENTS')))
+
+log_pipeline.setup_logging(
+    level=os.environ.get('CHAT_LOG_LEVEL', 'INFO').upper(),
+    json_output=os.environ.get('CHAT_LOG_JSON', '0') == '1',
+    event_settings=event_log_settings
+)
 logger = logging.getLogger(__name__)
+send_log = log_pipeline.event_logger("send_message")
+offer_log = log_pipeline.event_logger("webrtc_offer")
+answer_log = log_pipeline.event_logger("webrtc_answer")
+ice_log = log_pipeline.event_logger("webrtc_ice_candidate")
+typing_log = log_pipeline.event_logger("typing")
 
 app = Flask(__name__)
 CORS(app, origins="*", supports_credentials=True)
 
 # CONFIG
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///chat.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('CHAT_DATABASE_URL', 'sqlite:///chat.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['JWT_SECRET_KEY'] = 'change_this_secret_key'
+# Must match my_auth_backend's key so the tokens it issues verify here
+app.config['JWT_SECRET_KEY'] = os.environ.get('JWT_SECRET_KEY', 'change_this_to_a_strong_secret_key_in_production')
+if 'JWT_SECRET_KEY' not in os.environ:
+    logger.warning("JWT_SECRET_KEY is not set; using the built-in development key")
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(minutes=60)
 app.config['SECRET_KEY'] = 'your-secret-key-here'
 
-db = SQLAlchemy(app)
+# Socket authentication: clients connect with the access token issued by
+# my_auth_backend ({auth: {token}} or ?token=). With CHAT_REQUIRE_AUTH=0 the
+# legacy ?userId= handshake is still accepted for clients that send no token.
+app.config['CHAT_REQUIRE_AUTH'] = os.environ.get('CHAT_REQUIRE_AUTH', '0') == '1'
+
+MESSAGE_PAGE_SIZE = 50
+MESSAGE_PAGE_MAX = 200
+CALL_PAGE_SIZE = 50
+SEARCH_PAGE_SIZE = 20
+
+# Write-behind mode: messages are delivered immediately and persisted by a single
+# writer in batched transactions; message_sent goes out once the batch commits.
+app.config['MESSAGE_WRITE_BEHIND'] = os.environ.get('CHAT_WRITE_BEHIND', '0') == '1'
+app.config['MESSAGE_FLUSH_WINDOW_MS'] = int(os.environ.get('CHAT_FLUSH_WINDOW_MS', '20'))
+app.config['MESSAGE_FLUSH_MAX_BATCH'] = int(os.environ.get('CHAT_FLUSH_MAX_BATCH', '256'))
+app.config['MESSAGE_FLUSH_RETRIES'] = int(os.environ.get('CHAT_FLUSH_RETRIES', '5'))
+# Message ids are handed out in-process, so a second worker would reuse them
+if app.config['MESSAGE_WRITE_BEHIND'] and os.environ.get('CHAT_MESSAGE_QUEUE'):
+    raise RuntimeError("CHAT_WRITE_BEHIND=1 cannot be combined with CHAT_MESSAGE_QUEUE: "
+                       "only one process may write messages")
+
+# History tail cache: newest messages per conversation kept in memory so
+# re-opening a chat costs no database time (0 bytes = off). Only valid while
+# this process sees every message, so it is off by default with a message queue.
+app.config['HISTORY_CACHE_BYTES'] = int(os.environ.get(
+    'CHAT_HISTORY_CACHE_BYTES', '0' if os.environ.get('CHAT_MESSAGE_QUEUE') else str(16 * 1024 * 1024)))
+app.config['HISTORY_CACHE_TAIL'] = int(os.environ.get('CHAT_HISTORY_CACHE_TAIL', str(MESSAGE_PAGE_SIZE)))
+
+# ICE coalescing: trickle candidates to clients that connected with iceBatch=1
+# are buffered this long and delivered as one webrtc_ice_candidates event (0 = off).
+app.config['ICE_COALESCE_MS'] = int(os.environ.get('CHAT_ICE_COALESCE_MS', '0'))
+
+# Typing indicators: only start/stop transitions are relayed, plus at most one
+# refresh per interval; a silent sender is reported as stopped after the timeout.
+app.config['TYPING_REFRESH_MS'] = int(os.environ.get('CHAT_TYPING_REFRESH_MS', '3000'))
+app.config['TYPING_TIMEOUT_MS'] = int(os.environ.get('CHAT_TYPING_TIMEOUT_MS', '5000'))
+
+# Call lifecycle: a call nobody answers is marked missed after the ring timeout,
+# and one no client ever ends is closed after the max duration. The sweep closes
+# rows left open by a worker that exited mid-call.
+app.config['CALL_RING_TIMEOUT_SECONDS'] = float(os.environ.get('CHAT_CALL_RING_TIMEOUT_SECONDS', '45'))
+app.config['CALL_MAX_SECONDS'] = float(os.environ.get('CHAT_CALL_MAX_SECONDS', str(4 * 3600)))
+app.config['CALL_SWEEP_SECONDS'] = float(os.environ.get('CHAT_CALL_SWEEP_SECONDS', '60'))
+
+# Sampling profiler: POST /admin/profile with X-Admin-Token: $CHAT_ADMIN_TOKEN
+# (the route 404s while no token is set), or send SIGUSR2 to write a profile of
+# CHAT_PROFILE_SECONDS to a temp directory.
+app.config['ADMIN_TOKEN'] = os.environ.get('CHAT_ADMIN_TOKEN')
+app.config['PROFILE_SECONDS'] = float(os.environ.get('CHAT_PROFILE_SECONDS', '10'))
+PROFILE_MAX_SECONDS = 120
+
+db = persistence.create_db(app, persistence.settings_from_env('CHAT_'))
 jwt = JWTManager(app)
 
-socketio = SocketIO(
+# Prometheus metrics at /metrics: HTTP and Socket.IO latency, DB time, fan-out
+registry = metrics.Registry()
+metrics.instrument_app(app, registry, db)
+
+# Cross-process fan-out: set CHAT_MESSAGE_QUEUE (redis://..., unix:///run/chat,
+# memory://) so room, broadcast and sid emits reach clients on every worker.
+app.config['CHAT_MESSAGE_QUEUE'] = os.environ.get('CHAT_MESSAGE_QUEUE')
+
+# Per-packet Socket.IO/Engine.IO logging is for debugging only
+socketio_debug_logs = os.environ.get('CHAT_SOCKETIO_LOGS', '0') == '1'
+
+socketio = InstrumentedSocketIO(
     app, 
+    registry=registry,
     cors_allowed_origins="*",
-    logger=True,
-    engineio_logger=True,
+    logger=socketio_debug_logs,
+    engineio_logger=socketio_debug_logs,
     async_mode='eventlet',
     ping_timeout=60,
     ping_interval=25,
-    max_http_buffer_size=10000000
+    max_http_buffer_size=10000000,
+    **fanout.queue_options(app.config['CHAT_MESSAGE_QUEUE'])
 )
 
 # MODELS
@@ -48,9 +160,15 @@ class Message(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     sender_id = db.Column(db.Integer, nullable=False)
     receiver_id = db.Column(db.Integer, nullable=False)
+    # Normalized "<min>_<max>" pair so both directions of a thread share one index range
+    conversation_key = db.Column(db.String(64), nullable=False)
     message = db.Column(db.String(500), nullable=False)
     timestamp = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
 
+    __table_args__ = (
+        db.Index('ix_message_conversation_ts_id', 'conversation_key', 'timestamp', 'id'),
+    )
+
 class Call(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     caller_id = db.Column(db.Integer, nullable=False)
@@ -60,33 +178,575 @@ class Call(db.Model):
     started_at = db.Column(db.DateTime)
     ended_at = db.Column(db.DateTime)
 
-with app.app_context():
-    db.create_all()
+    __table_args__ = (
+        db.Index('ix_call_status_started', 'status', 'started_at'),
+        db.Index('ix_call_caller_started', 'caller_id', 'started_at'),
+        db.Index('ix_call_receiver_started', 'receiver_id', 'started_at'),
+    )
+
+class CallStats(db.Model):
+    # Running totals per user over finished calls, updated in the same
+    # transaction that gives a call its final status
+    user_id = db.Column(db.Integer, primary_key=True)
+    calls_made = db.Column(db.Integer, nullable=False, default=0)
+    calls_received = db.Column(db.Integer, nullable=False, default=0)
+    answered = db.Column(db.Integer, nullable=False, default=0)
+    missed = db.Column(db.Integer, nullable=False, default=0)
+    total_duration_seconds = db.Column(db.Float, nullable=False, default=0.0)
+
+class ReadReceipt(db.Model):
+    # One row per reader and conversation: everything up to this message id is read
+    user_id = db.Column(db.Integer, primary_key=True)
+    conversation_key = db.Column(db.String(64), primary_key=True)
+    last_read_message_id = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+
+class ConversationSummary(db.Model):
+    # Inbox row per participant, maintained in the same transaction as message
+    # inserts and read receipts so listing conversations is one indexed query
+    user_id = db.Column(db.Integer, primary_key=True)
+    conversation_key = db.Column(db.String(64), primary_key=True)
+    peer_id = db.Column(db.Integer, nullable=False)
+    last_message_id = db.Column(db.Integer, nullable=False)
+    last_sender_id = db.Column(db.Integer, nullable=False)
+    last_message = db.Column(db.String(500), nullable=False)
+    last_timestamp = db.Column(db.DateTime)
+    unread_count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('ix_conversation_summary_user_last', 'user_id', 'last_message_id'),
+    )
 
 # HELPERS
+def get_conversation_key(user1, user2):
+    return f"{min(user1, user2)}_{max(user1, user2)}"
+
 def get_chat_room(user1, user2):
-    return f"chat_room_{min(user1, user2)}_{max(user1, user2)}"
+    return f"chat_room_{get_conversation_key(user1, user2)}"
 
 def get_call_room(call_uuid):
     return f"call_room_{call_uuid}"
 
-connected_users = {}
-active_calls = {}
+def get_user_room(user_id):
+    # Every socket of a user joins this room, so one emit reaches all their devices
+    return f"user_room_{user_id}"
+
+def serialize_message(msg):
+    return {
+        'id': msg.id,
+        'sender_id': msg.sender_id,
+        'receiver_id': msg.receiver_id,
+        'message': msg.message,
+        'timestamp': msg.timestamp.isoformat()
+    }
+
+def serialize_call(call):
+    return {
+        'id': call.id,
+        'caller_id': call.caller_id,
+        'receiver_id': call.receiver_id,
+        'call_uuid': call.call_uuid,
+        'status': call.status,
+        'started_at': call.started_at.isoformat() if call.started_at else None,
+        'ended_at': call.ended_at.isoformat() if call.ended_at else None
+    }
+
+# SCHEMA UPGRADES
+# db.create_all() only creates missing tables, so columns added after a database
+# was first created are patched in here.
+def upgrade_schema():
+    columns = {row[1] for row in db.session.execute(db.text("PRAGMA table_info(message)"))}
+    if 'conversation_key' not in columns:
+        logger.info("🔧 Adding message.conversation_key and backfilling existing rows")
+        db.session.execute(db.text("ALTER TABLE message ADD COLUMN conversation_key VARCHAR(64) NOT NULL DEFAULT ''"))
+        db.session.execute(db.text(
+            "UPDATE message SET conversation_key = "
+            "min(sender_id, receiver_id) || '_' || max(sender_id, receiver_id)"
+        ))
+    db.session.execute(db.text(
+        "CREATE INDEX IF NOT EXISTS ix_message_conversation_ts_id "
+        "ON message (conversation_key, timestamp, id)"
+    ))
+    db.session.execute(db.text(
+        "CREATE INDEX IF NOT EXISTS ix_call_status_started ON call (status, started_at)"
+    ))
+    db.session.execute(db.text(
+        "CREATE INDEX IF NOT EXISTS ix_call_caller_started ON call (caller_id, started_at)"
+    ))
+    db.session.execute(db.text(
+        "CREATE INDEX IF NOT EXISTS ix_call_receiver_started ON call (receiver_id, started_at)"
+    ))
+    if db.session.query(ConversationSummary.user_id).first() is None:
+        rebuild_conversation_summaries()
+    if db.session.query(CallStats.user_id).first() is None:
+        rebuild_call_stats()
+    if message_search.ensure_index(db.session):
+        logger.info("🔧 Building the message search index")
+        message_search.rebuild(db.session)
+    db.session.commit()
+
+def rebuild_conversation_summaries():
+    # One-off backfill for databases that have messages but no inbox rows yet
+    logger.info("🔧 Rebuilding conversation summaries")
+    db.session.execute(db.delete(ConversationSummary))
+    db.session.execute(db.text("""
+        INSERT INTO conversation_summary
+            (user_id, conversation_key, peer_id, last_message_id, last_sender_id,
+             last_message, last_timestamp, unread_count)
+        SELECT p.user_id, m.conversation_key, p.peer_id, m.id, m.sender_id,
+               m.message, m.timestamp,
+               (SELECT count(*) FROM message u
+                WHERE u.conversation_key = m.conversation_key
+                  AND u.receiver_id = p.user_id AND u.sender_id != p.user_id
+                  AND u.id > coalesce((SELECT r.last_read_message_id FROM read_receipt r
+                                       WHERE r.user_id = p.user_id
+                                         AND r.conversation_key = m.conversation_key), 0))
+        FROM message m
+        JOIN (SELECT max(id) AS id FROM message GROUP BY conversation_key) last ON last.id = m.id
+        JOIN (SELECT id, sender_id AS user_id, receiver_id AS peer_id FROM message
+              UNION
+              SELECT id, receiver_id, sender_id FROM message) p ON p.id = m.id
+    """))
+
+def rebuild_call_stats():
+    # One-off backfill for databases that have finished calls but no stats rows yet
+    logger.info("🔧 Rebuilding call stats")
+    db.session.execute(db.delete(CallStats))
+    db.session.execute(db.text("""
+        INSERT INTO call_stats
+            (user_id, calls_made, calls_received, answered, missed, total_duration_seconds)
+        SELECT user_id, sum(outgoing), sum(1 - outgoing),
+               sum(status = 'ended'),
+               sum(status = 'missed' AND outgoing = 0),
+               coalesce(sum(CASE WHEN status = 'ended'
+                            THEN (julianday(ended_at) - julianday(started_at)) * 86400 END), 0)
+        FROM (SELECT caller_id AS user_id, 1 AS outgoing, status, started_at, ended_at FROM call
+              UNION ALL
+              SELECT receiver_id, 0, status, started_at, ended_at FROM call)
+        WHERE status IN ('rejected', 'missed', 'ended')
+        GROUP BY user_id
+    """))
+
+with app.app_context():
+    db.create_all()
+    upgrade_schema()
+
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index():
+    """Re-index every message for /messages/search."""
+    message_search.ensure_index(db.session)
+    message_search.rebuild(db.session)
+    db.session.commit()
+    click.echo(f"Indexed {db.session.query(Message).count()} messages")
+
+# MESSAGE WRITE PIPELINE
+_message_ids = None
+_last_message_id = 0
+
+def next_message_id():
+    # Ids are handed out before the row exists, so the write-behind mode
+    # assumes this process is the only one inserting messages.
+    global _message_ids, _last_message_id
+    if _message_ids is None:
+        max_id = db.session.query(db.func.max(Message.id)).scalar() or 0
+        _message_ids = itertools.count(max_id + 1)
+    message_id = next(_message_ids)
+    _last_message_id = max(_last_message_id, message_id)
+    return message_id
+
+def is_allocated_message_id(message_id):
+    """True if ``message_id`` was handed out here, whether or not its row is committed yet."""
+    return 0 < message_id <= _last_message_id
+
+def message_row(msg):
+    return {
+        'id': msg.id,
+        'sender_id': msg.sender_id,
+        'receiver_id': msg.receiver_id,
+        'conversation_key': msg.conversation_key,
+        'message': msg.message,
+        'timestamp': msg.timestamp
+    }
+
+def read_watermarks(keys):
+    """``{(user_id, conversation_key): last_read_message_id}`` for the given keys."""
+    if not keys:
+        return {}
+    receipts = db.session.query(
+        ReadReceipt.user_id, ReadReceipt.conversation_key, ReadReceipt.last_read_message_id
+    ).filter(db.tuple_(ReadReceipt.user_id, ReadReceipt.conversation_key).in_(list(keys)))
+    return {(user_id, key): last_read for user_id, key, last_read in receipts}
+
+def update_conversation_summaries(rows):
+    """Fold newly inserted message rows into both participants' inbox rows.
+
+    Runs inside the caller's transaction; rows must be in id order. A message
+    the reader already marked read (possible in write-behind mode, where ids
+    are handed out before the batch commits) is not counted as unread.
+    """
+    read_up_to = read_watermarks({(row['receiver_id'], row['conversation_key']) for row in rows})
+    summaries = {}
+    for row in rows:
+        sender_id, receiver_id = row['sender_id'], row['receiver_id']
+        already_read = row['id'] <= read_up_to.get((receiver_id, row['conversation_key']), 0)
+        for user_id, peer_id, unread in ((sender_id, receiver_id, 0), (receiver_id, sender_id, 1)):
+            if user_id == sender_id and unread:
+                continue  # Messages to yourself are never unread
+            if unread and already_read:
+                unread = 0
+            key = (user_id, row['conversation_key'])
+            summary = summaries.get(key)
+            summaries[key] = {
+                'user_id': user_id,
+                'conversation_key': row['conversation_key'],
+                'peer_id': peer_id,
+                'last_message_id': row['id'],
+                'last_sender_id': sender_id,
+                'last_message': row['message'],
+                'last_timestamp': row['timestamp'],
+                'unread_count': (summary['unread_count'] if summary else 0) + unread
+            }
+    if not summaries:
+        return
+    stmt = sqlite_insert(ConversationSummary)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['user_id', 'conversation_key'],
+        set_={
+            'last_message_id': stmt.excluded.last_message_id,
+            'last_sender_id': stmt.excluded.last_sender_id,
+            'last_message': stmt.excluded.last_message,
+            'last_timestamp': stmt.excluded.last_timestamp,
+            'unread_count': ConversationSummary.unread_count + stmt.excluded.unread_count
+        }
+    )
+    db.session.execute(stmt, list(summaries.values()))
+
+def persist_messages(rows):
+    with app.app_context():
+        db.session.execute(db.insert(Message), rows)
+        update_conversation_summaries(rows)
+        db.session.commit()
+
+history_cache = None
+if app.config['HISTORY_CACHE_BYTES'] > 0:
+    history_cache = ConversationTailCache(app.config['HISTORY_CACHE_BYTES'], app.config['HISTORY_CACHE_TAIL'])
+
+def cache_committed_message(row):
+    if history_cache is None:
+        return
+    history_cache.append(row['conversation_key'], {
+        'id': row['id'],
+        'sender_id': row['sender_id'],
+        'receiver_id': row['receiver_id'],
+        'message': row['message'],
+        'timestamp': row['timestamp'].isoformat()
+    })
+
+def on_messages_committed(batch):
+    for row, sid in batch:
+        cache_committed_message(row)
+        socketio.emit("message_sent", {
+            "timestamp": row['timestamp'].isoformat(),
+            "message_id": row['id']
+        }, to=sid)
+    logger.info(f"✅ Committed batch of {len(batch)} messages")
+
+def on_messages_failed(batch, error):
+    for row, sid in batch:
+        socketio.emit("error", {
+            "message": "Failed to send message",
+            "message_id": row['id']
+        }, to=sid)
+
+def is_transient_db_error(error):
+    # "database is locked"/"busy": the batch was rolled back and can be retried as is
+    return isinstance(error, OperationalError) and any(
+        word in str(error) for word in ('locked', 'busy'))
+
+message_writer = GroupCommitWriter(
+    persist_messages,
+    window=app.config['MESSAGE_FLUSH_WINDOW_MS'] / 1000.0,
+    max_batch=app.config['MESSAGE_FLUSH_MAX_BATCH'],
+    on_commit=on_messages_committed,
+    on_error=on_messages_failed,
+    retries=app.config['MESSAGE_FLUSH_RETRIES'],
+    is_transient=is_transient_db_error
+)
+
+if app.config['MESSAGE_WRITE_BEHIND']:
+    message_writer.start(socketio.start_background_task)
+    atexit.register(message_writer.drain)
+
+presence = PresenceRegistry()
 call_room_users = {}  # Track users in each call room
 
-def get_user_id_by_sid(sid):
-    for uid, user_sid in connected_users.items():
-        if user_sid == sid:
-            return int(uid)
+def emit_to_user(event, payload, user_id):
+    """Emit to every connected device of ``user_id``; False if they are offline.
+
+    Presence is tracked per worker, so with a message queue the emit always
+    goes out (the user may be connected to another worker).
+    """
+    if not presence.is_online(user_id) and not app.config['CHAT_MESSAGE_QUEUE']:
+        return False
+    socketio.emit(event, payload, to=get_user_room(user_id))
+    return True
+
+def flush_ice_candidates(key, candidates):
+    from_id, target_id, call_uuid = key
+    socketio.emit("webrtc_ice_candidates", {
+        "from": from_id,
+        "to": target_id,
+        "call_uuid": call_uuid,
+        "candidates": candidates
+    }, to=get_user_room(target_id))
+    ice_log.info(f"✅ {len(candidates)} ICE candidates sent to {target_id}")
+
+ice_coalescer = IceCoalescer(
+    app.config['ICE_COALESCE_MS'] / 1000.0,
+    flush_ice_candidates,
+    spawn=socketio.start_background_task,
+    sleep=socketio.sleep
+)
+
+def emit_typing(sender_id, receiver_id, room, is_typing, sid):
+    socketio.emit("typing", {
+        "sender_id": sender_id,
+        "receiver_id": receiver_id,
+        "typing": is_typing
+    }, to=room, skip_sid=sid)
+
+typing_tracker = TypingTracker(
+    app.config['TYPING_REFRESH_MS'] / 1000.0,
+    app.config['TYPING_TIMEOUT_MS'] / 1000.0,
+    emit_typing,
+    spawn=socketio.start_background_task,
+    sleep=socketio.sleep
+)
+
+# CALL LIFECYCLE
+# The Call row is what every worker sees, so each status change is a
+# compare-and-set on it; the tracker only holds this worker's timers.
+def set_call_status(call_uuid, from_status, to_status, receiver_id=None):
+    """Move the Call row from ``from_status``; False if it already moved on.
+
+    With ``receiver_id``, only a call to that user is moved.
+    """
+    now = datetime.now(timezone.utc)
+    values = {'status': to_status}
+    if to_status == ACCEPTED:
+        values['started_at'] = now
+    else:
+        values['ended_at'] = now
+    stmt = db.update(Call).where(Call.call_uuid == call_uuid, Call.status == from_status)
+    if receiver_id is not None:
+        stmt = stmt.where(Call.receiver_id == receiver_id)
+    row = db.session.execute(
+        stmt
+        .values(**values)
+        .returning(Call.caller_id, Call.receiver_id, Call.started_at)
+    ).first()
+    if row is not None and to_status != ACCEPTED:
+        duration = 0.0
+        if to_status == ENDED and row.started_at is not None:
+            # SQLite hands datetimes back naive (UTC). Calls closed by a timeout
+            # or the sweeper (possibly days after a restart) count as lasting
+            # at most CALL_MAX_SECONDS.
+            duration = (now.replace(tzinfo=None) - row.started_at).total_seconds()
+            duration = min(max(0.0, duration), app.config['CALL_MAX_SECONDS'])
+        record_call_stats(row.caller_id, row.receiver_id, to_status, duration)
+    db.session.commit()
+    return row is not None
+
+def record_call_stats(caller_id, receiver_id, status, duration):
+    """Fold one finished call into both participants' stats rows.
+
+    Runs inside the caller's transaction.
+    """
+    answered = 1 if status == ENDED else 0
+    rows = [
+        {'user_id': caller_id, 'calls_made': 1, 'calls_received': 0, 'answered': answered,
+         'missed': 0, 'total_duration_seconds': duration},
+        {'user_id': receiver_id, 'calls_made': 0, 'calls_received': 1, 'answered': answered,
+         'missed': 1 if status == MISSED else 0, 'total_duration_seconds': duration},
+    ]
+    stmt = sqlite_insert(CallStats)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['user_id'],
+        set_={
+            column: getattr(CallStats, column) + getattr(stmt.excluded, column)
+            for column in ('calls_made', 'calls_received', 'answered', 'missed', 'total_duration_seconds')
+        }
+    )
+    db.session.execute(stmt, rows)
+
+def call_participants(call_uuid):
+    """(caller_id, receiver_id) of the call, or None if there is no such call."""
+    row = db.session.query(Call.caller_id, Call.receiver_id).filter_by(call_uuid=call_uuid).first()
+    return tuple(row) if row is not None else None
+
+def close_call(call_uuid):
+    """Hang up: an accepted call ends, a ringing one is missed."""
+    return set_call_status(call_uuid, ACCEPTED, ENDED) or set_call_status(call_uuid, RINGING, MISSED)
+
+def release_call(call_uuid, state=None):
+    """Drop everything this worker keeps for the call.
+
+    Pass ``state`` when the tracker has already let go of it (a transition
+    into a final status), so presence is still cleaned up.
+    """
+    state = call_tracker.remove(call_uuid) or state
+    if state:
+        presence.remove_call(call_uuid, state.caller_id, state.receiver_id)
+    call_room_users.pop(call_uuid, None)
+    ice_coalescer.discard_call(call_uuid)
+    return state
+
+def notify_call_ended(call_uuid, from_id, user_ids, reason):
+    for user_id in user_ids:
+        emit_to_user("call_ended", {
+            "from": from_id,
+            "call_uuid": call_uuid,
+            "reason": reason
+        }, user_id)
+
+def expire_call(state):
+    # Runs on the tracker's timer loop, outside any request
+    with app.app_context():
+        try:
+            target, reason = (MISSED, 'missed') if state.status == RINGING else (ENDED, 'timeout')
+            if set_call_status(state.call_uuid, state.status, target):
+                release_call(state.call_uuid)
+                call_expirations.inc(reason)
+                notify_call_ended(state.call_uuid, None, (state.caller_id, state.receiver_id), reason)
+                logger.info(f"⏱️ Call {state.call_uuid} closed: {reason}")
+                return
+            current = db.session.query(Call.status).filter_by(call_uuid=state.call_uuid).scalar()
+            if state.status == RINGING and current == ACCEPTED:
+                # Answered through another worker; keep the max-duration timer here too
+                call_tracker.adopt(state.call_uuid, state.caller_id, state.receiver_id, state.call_type, ACCEPTED)
+            else:
+                release_call(state.call_uuid)
+        except Exception as e:
+            db.session.rollback()
+            release_call(state.call_uuid)
+            logger.exception(f"❌ Error expiring call {state.call_uuid}: {e}")
+
+def sweep_stale_calls():
+    """Close Call rows whose worker exited before their timers fired."""
+    now = datetime.now(timezone.utc)
+    # A full sweep interval of grace, so live workers' own timers always win
+    grace = app.config['CALL_SWEEP_SECONDS']
+    rows = db.session.query(Call.call_uuid, Call.caller_id, Call.receiver_id, Call.status).filter(db.or_(
+        db.and_(Call.status == RINGING,
+                Call.started_at < now - timedelta(seconds=app.config['CALL_RING_TIMEOUT_SECONDS'] + grace)),
+        db.and_(Call.status == ACCEPTED,
+                Call.started_at < now - timedelta(seconds=app.config['CALL_MAX_SECONDS'] + grace)),
+    )).all()
+    for call_uuid, caller_id, receiver_id, status in rows:
+        target, reason = (MISSED, 'missed') if status == RINGING else (ENDED, 'timeout')
+        if set_call_status(call_uuid, status, target):
+            release_call(call_uuid)
+            call_expirations.inc('stale')
+            notify_call_ended(call_uuid, None, (caller_id, receiver_id), reason)
+    if rows:
+        logger.info(f"🧹 Swept {len(rows)} stale calls")
+
+def run_call_sweeper():
+    while True:
+        socketio.sleep(app.config['CALL_SWEEP_SECONDS'])
+        with app.app_context():
+            try:
+                sweep_stale_calls()
+            except Exception as e:
+                db.session.rollback()
+                logger.exception(f"❌ Error sweeping stale calls: {e}")
+
+call_tracker = CallTracker(
+    app.config['CALL_RING_TIMEOUT_SECONDS'],
+    app.config['CALL_MAX_SECONDS'],
+    expire_call,
+    spawn=socketio.start_background_task,
+    sleep=socketio.sleep
+)
+call_tracker.start()
+socketio.start_background_task(run_call_sweeper)
+
+socket_auth = SocketAuth(decode_token)
+
+registry.gauge('chat_connected_users', 'Users with at least one socket on this worker', lambda: len(presence))
+registry.gauge('chat_connections', 'Sockets connected to this worker', presence.connection_count)
+registry.gauge('chat_active_calls', 'Calls ringing or in progress', lambda: len(call_tracker))
+registry.gauge('chat_calls', 'Calls tracked on this worker by state', lambda: {
+    (status,): call_tracker.count(status) for status in (RINGING, ACCEPTED)
+}, ('state',))
+call_expirations = registry.counter(
+    'chat_call_expirations_total', 'Calls closed by the server instead of a client', ('reason',))
+registry.gauge('chat_call_rooms', 'Call rooms with tracked participants', lambda: len(call_room_users))
+registry.gauge('chat_call_room_users', 'Participants across all call rooms',
+               lambda: sum(len(users) for users in call_room_users.values()))
+registry.gauge('chat_pending_messages', 'Messages waiting for the write-behind commit', message_writer.pending)
+registry.callback_counter('chat_history_cache_lookups_total', 'History tail cache lookups',
+                          lambda: {('hit',): history_cache.hits, ('miss',): history_cache.misses}
+                          if history_cache else {}, ('result',))
+registry.callback_counter('chat_socket_auth_lookups_total', 'Socket token verifications by cache result',
+                          lambda: {('hit',): socket_auth.hits, ('miss',): socket_auth.misses}, ('result',))
+
+def get_connect_token(auth):
+    if isinstance(auth, dict) and auth.get('token'):
+        return auth['token']
+    if request.args.get('token'):
+        return request.args['token']
+    header = request.headers.get('Authorization', '')
+    if header.startswith('Bearer '):
+        return header[len('Bearer '):]
     return None
 
+def acting_as(field):
+    """Only run the handler if this socket may act as the user in ``data[field]``.
+
+    Authenticated sockets are checked against the user bound at connect (a
+    dict lookup; the token was verified once). Unauthenticated legacy sockets
+    pass through unless CHAT_REQUIRE_AUTH is set.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(data):
+            claims = socket_auth.claims(request.sid)
+            if claims is None:
+                if socket_auth.is_bound(request.sid) or app.config['CHAT_REQUIRE_AUTH']:
+                    emit("error", {"message": "Authentication expired or missing"}, room=request.sid)
+                    disconnect()
+                    return
+                return handler(data)
+            claimed = data.get(field) if isinstance(data, dict) else None
+            if claimed is not None and str(claimed) != str(claims['sub']):
+                logger.warning(f"⚠️ SID {request.sid} (user {claims['sub']}) tried to act as {claimed}")
+                emit("error", {"message": "Not allowed to act as another user"}, room=request.sid)
+                return
+            return handler(data)
+        return wrapper
+    return decorator
+
 # SOCKET.IO EVENTS
 @socketio.on("connect")
-def handle_connect():
+def handle_connect(auth=None):
     try:
-        user_id = request.args.get('userId')
+        token = get_connect_token(auth)
+        if token:
+            try:
+                user_id = socket_auth.authenticate(request.sid, token)['sub']
+            except Exception as e:
+                logger.warning(f"⚠️ Rejected socket with invalid token: {e}")
+                return False
+        elif app.config['CHAT_REQUIRE_AUTH']:
+            logger.warning("⚠️ Rejected socket without token")
+            return False
+        else:
+            user_id = request.args.get('userId')
         if user_id:
-            connected_users[str(user_id)] = request.sid
+            features = {'ice_batch'} if request.args.get('iceBatch') == '1' else ()
+            presence.connect(int(user_id), request.sid, features)
+            join_room(get_user_room(int(user_id)))
             logger.info(f"✅ User {user_id} connected with SID {request.sid}")
             emit("connected", {"message": "Connected to chat server", "user_id": user_id}, room=request.sid)
         else:
@@ -95,26 +755,22 @@ def handle_connect():
         logger.error(f"❌ Error in connect: {e}")
 
 @socketio.on("disconnect")
-def handle_disconnect():
+def handle_disconnect(reason=None):
     try:
-        user_id = get_user_id_by_sid(request.sid)
-        if user_id:
-            if str(user_id) in connected_users:
-                del connected_users[str(user_id)]
-            
-            call_uuid_to_remove = None
-            for call_uuid, call_data in active_calls.items():
-                if call_data['caller_id'] == user_id or call_data['receiver_id'] == user_id:
-                    call_uuid_to_remove = call_uuid
-                    break
-            
-            if call_uuid_to_remove:
-                del active_calls[call_uuid_to_remove]
-                # Clean up call room users tracking
-                if call_uuid_to_remove in call_room_users:
-                    del call_room_users[call_uuid_to_remove]
-            
+        socket_auth.release(request.sid)
+        user_id, went_offline = presence.disconnect(request.sid)
+        if user_id is not None:
             logger.info(f"❌ User {user_id} disconnected: {request.sid}")
+            if not went_offline:
+                # Another device of this user is still connected
+                return
+
+            for call_uuid in presence.calls_for(user_id):
+                state = release_call(call_uuid)
+                if close_call(call_uuid) and state:
+                    peer = state.receiver_id if user_id == state.caller_id else state.caller_id
+                    notify_call_ended(call_uuid, user_id, (peer,), 'disconnected')
+            
             emit("user_disconnected", {"user_id": user_id}, broadcast=True)
             
     except Exception as e:
@@ -122,6 +778,7 @@ def handle_disconnect():
 
 # JOIN ROOM & CHAT
 @socketio.on("join")
+@acting_as("sender_id")
 def handle_join(data):
     try:
         sender_id = int(data['sender_id'])
@@ -147,6 +804,7 @@ def handle_join(data):
         emit("error", {"message": "Failed to join room"}, room=request.sid)
 
 @socketio.on("send_message")
+@acting_as("sender_id")
 def handle_send_message(data):
     try:
         sender_id = int(data["sender_id"])
@@ -157,39 +815,68 @@ def handle_send_message(data):
             emit("error", {"message": "Message cannot be empty"}, room=request.sid)
             return
 
-        msg = Message(
-            sender_id=sender_id, 
-            receiver_id=receiver_id, 
-            message=message_text
-        )
-        db.session.add(msg)
-        db.session.commit()
-        db.session.refresh(msg)
-
         room = get_chat_room(sender_id, receiver_id)
+
+        if app.config['MESSAGE_WRITE_BEHIND']:
+            row = {
+                'id': next_message_id(),
+                'sender_id': sender_id,
+                'receiver_id': receiver_id,
+                'conversation_key': get_conversation_key(sender_id, receiver_id),
+                'message': message_text,
+                # Naive UTC, matching what the column default round-trips as
+                'timestamp': datetime.now(timezone.utc).replace(tzinfo=None)
+            }
+            message_writer.submit(row, request.sid)
+            message_id = row['id']
+            timestamp = row['timestamp'].isoformat()
+        else:
+            msg = Message(
+                sender_id=sender_id, 
+                receiver_id=receiver_id, 
+                conversation_key=get_conversation_key(sender_id, receiver_id),
+                message=message_text
+            )
+            db.session.add(msg)
+            db.session.flush()
+            update_conversation_summaries([message_row(msg)])
+            db.session.commit()
+            db.session.refresh(msg)
+            cache_committed_message(message_row(msg))
+            message_id = msg.id
+            timestamp = msg.timestamp.isoformat()
+
         payload = {
             "sender_id": sender_id, 
             "receiver_id": receiver_id, 
             "message": message_text, 
-            "timestamp": msg.timestamp.isoformat(), 
-            "message_id": msg.id
+            "timestamp": timestamp, 
+            "message_id": message_id
         }
 
         emit("receive_message", payload, to=room)
         
-        emit("message_sent", {
-            "timestamp": msg.timestamp.isoformat(), 
-            "message_id": msg.id
-        }, room=request.sid)
+        if app.config['MESSAGE_WRITE_BEHIND']:
+            # Accepted but not yet durable; message_sent follows the batch commit
+            emit("message_queued", {
+                "timestamp": timestamp, 
+                "message_id": message_id
+            }, room=request.sid)
+        else:
+            emit("message_sent", {
+                "timestamp": timestamp, 
+                "message_id": message_id
+            }, room=request.sid)
 
-        logger.info(f"✅ Message sent from {sender_id} to {receiver_id}")
+        send_log.info(f"✅ Message sent from {sender_id} to {receiver_id}")
 
     except Exception as e:
-        logger.exception(f"❌ Error sending message: {e}")
+        send_log.exception(f"❌ Error sending message: {e}")
         emit("error", {"message": "Failed to send message"}, room=request.sid)
 
 # CALL REQUEST / RESPONSE - FIXED FOR PROPER CALL HANDLING
 @socketio.on("call_request")
+@acting_as("from")
 def handle_call_request(data):
     try:
         caller = int(data["from"])
@@ -210,13 +897,9 @@ def handle_call_request(data):
 
         logger.info(f"✅ Call record created: {call.call_uuid}")
 
-        # Store call with type information
-        active_calls[call.call_uuid] = {
-            'caller_id': caller,
-            'receiver_id': callee,
-            'call_type': call_type,
-            'status': 'ringing'
-        }
+        # Ringing until answered, rejected or the ring timeout marks it missed
+        call_tracker.ring(call.call_uuid, caller, callee, request.sid, call_type)
+        presence.add_call(call.call_uuid, caller, callee)
 
         payload = {
             "call_uuid": call.call_uuid, 
@@ -226,15 +909,15 @@ def handle_call_request(data):
             "timestamp": datetime.now(timezone.utc).isoformat()
         }
         
-        callee_sid = connected_users.get(str(callee))
-        if callee_sid:
-            emit("incoming_call", payload, room=callee_sid)
+        if emit_to_user("incoming_call", payload, callee):
             logger.info(f"✅ Incoming call sent to callee {callee} with type: {call_type}")
         else:
             emit("call_failed", {
                 "message": "User is offline", 
                 "call_uuid": call.call_uuid
             }, room=request.sid)
+            set_call_status(call.call_uuid, RINGING, MISSED)
+            release_call(call.call_uuid)
             logger.warning(f"❌ Callee {callee} not connected")
 
     except Exception as e:
@@ -242,6 +925,7 @@ def handle_call_request(data):
         emit("error", {"message": "Failed to request call"}, room=request.sid)
 
 @socketio.on("call_response")
+@acting_as("from")
 def handle_call_response(data):
     try:
         callee = int(data["from"])
@@ -251,48 +935,51 @@ def handle_call_response(data):
 
         logger.info(f"📣 Call response: {action} from {callee} to {caller}, UUID: {call_uuid}")
 
-        call = Call.query.filter_by(call_uuid=call_uuid).first()
-        call_type = "video"
-        
-        if call:
-            call.status = "accepted" if action == "accept" else "rejected"
-            if action == "accept":
-                call.started_at = datetime.now(timezone.utc)
-                if call_uuid in active_calls:
-                    active_calls[call_uuid]['status'] = 'accepted'
-            db.session.commit()
-            logger.info(f"✅ Call status updated to: {call.status}")
-            
-            # Get call_type from active_calls
-            if call_uuid in active_calls:
-                call_type = active_calls[call_uuid].get('call_type', 'video')
-
-        caller_sid = connected_users.get(str(caller))
-        if caller_sid:
-            # Include type in response - FIXED FOR PROPER CALL TYPE HANDLING
-            payload = {
-                "call_uuid": call_uuid, 
-                "from": callee, 
-                "action": action,
-                "type": call_type,
-                "timestamp": datetime.now(timezone.utc).isoformat()
-            }
-            emit("call_response", payload, room=caller_sid)
+        status = ACCEPTED if action == "accept" else REJECTED
+        if not set_call_status(call_uuid, RINGING, status, receiver_id=callee):
+            # Already missed, cancelled, answered on another device, or not this user's call
+            emit("call_failed", {
+                "message": "Call is no longer ringing",
+                "call_uuid": call_uuid
+            }, room=request.sid)
+            logger.warning(f"⚠️ Late call_response for {call_uuid}")
+            return
+        logger.info(f"✅ Call status updated to: {status}")
+
+        state = call_tracker.transition(call_uuid, status)
+        if state is None and status == ACCEPTED:
+            # Rang from another worker; track it here too so it still times out
+            state = call_tracker.adopt(call_uuid, caller, callee, data.get("type", "video"), ACCEPTED)
+            presence.add_call(call_uuid, caller, callee)
+        call_type = state.call_type if state else "video"
+        caller_sid = state.caller_sid if state else None
+        if status == REJECTED:
+            release_call(call_uuid, state)
+
+        # Include type in response - FIXED FOR PROPER CALL TYPE HANDLING
+        payload = {
+            "call_uuid": call_uuid, 
+            "from": callee, 
+            "action": action,
+            "type": call_type,
+            "timestamp": datetime.now(timezone.utc).isoformat()
+        }
+        if emit_to_user("call_response", payload, caller):
             logger.info(f"✅ Call response sent to caller {caller} with type: {call_type}")
             
             if action == "accept":
                 call_room = get_call_room(call_uuid)
                 
-                caller_sid = connected_users.get(str(caller))
-                callee_sid = connected_users.get(str(callee))
+                # Only the device that placed the call and the one that answered join
+                if caller_sid not in presence.sids_for(caller):
+                    caller_sid = next(iter(presence.sids_for(caller)), None)
                 
                 if caller_sid:
                     join_room(call_room, sid=caller_sid)
                     logger.info(f"✅ Caller {caller} joined call room: {call_room}")
                 
-                if callee_sid:
-                    join_room(call_room, sid=callee_sid)
-                    logger.info(f"✅ Callee {callee} joined call room: {call_room}")
+                join_room(call_room, sid=request.sid)
+                logger.info(f"✅ Callee {callee} joined call room: {call_room}")
                 
                 # Track users in call room
                 if call_uuid not in call_room_users:
@@ -315,64 +1002,71 @@ def handle_call_response(data):
 
 # WEBRTC SIGNALING
 @socketio.on("webrtc_offer")
+@acting_as("from")
 def handle_webrtc_offer(data):
     try:
         target_id = int(data.get("to"))
         from_id = int(data.get("from"))
         
-        logger.info(f"📨 WebRTC offer from {from_id} to {target_id}")
+        offer_log.info(f"📨 WebRTC offer from {from_id} to {target_id}")
         
-        target_sid = connected_users.get(str(target_id))
-        if target_sid:
-            emit("webrtc_offer", data, room=target_sid)
-            logger.info(f"✅ WebRTC offer sent to {target_id}")
+        if emit_to_user("webrtc_offer", data, target_id):
+            offer_log.info(f"✅ WebRTC offer sent to {target_id}")
         else:
-            logger.warning(f"❌ Target user {target_id} not connected")
+            offer_log.warning(f"❌ Target user {target_id} not connected")
             
     except Exception as e:
-        logger.exception(f"❌ Error in webrtc_offer: {e}")
+        offer_log.exception(f"❌ Error in webrtc_offer: {e}")
 
 @socketio.on("webrtc_answer")
+@acting_as("from")
 def handle_webrtc_answer(data):
     try:
         target_id = int(data.get("to"))
         from_id = int(data.get("from"))
         
-        logger.info(f"📨 WebRTC answer from {from_id} to {target_id}")
+        answer_log.info(f"📨 WebRTC answer from {from_id} to {target_id}")
         
-        target_sid = connected_users.get(str(target_id))
-        if target_sid:
-            emit("webrtc_answer", data, room=target_sid)
-            logger.info(f"✅ WebRTC answer sent to {target_id}")
+        if emit_to_user("webrtc_answer", data, target_id):
+            answer_log.info(f"✅ WebRTC answer sent to {target_id}")
         else:
-            logger.warning(f"❌ Target user {target_id} not connected")
+            answer_log.warning(f"❌ Target user {target_id} not connected")
             
     except Exception as e:
-        logger.exception(f"❌ Error in webrtc_answer: {e}")
+        answer_log.exception(f"❌ Error in webrtc_answer: {e}")
 
 @socketio.on("webrtc_ice_candidate")
+@acting_as("from")
 def handle_webrtc_ice(data):
     try:
         target_id = int(data.get("to"))
         from_id = int(data.get("from"))
         
-        logger.info(f"❄️ ICE candidate from {from_id} to {target_id}")
+        ice_log.info(f"❄️ ICE candidate from {from_id} to {target_id}")
         
-        target_sid = connected_users.get(str(target_id))
-        if target_sid:
-            emit("webrtc_ice_candidate", data, room=target_sid)
-            logger.info(f"✅ ICE candidate sent to {target_id}")
+        if app.config['ICE_COALESCE_MS'] > 0 and presence.supports(target_id, 'ice_batch'):
+            # The envelope is the same for every candidate in the batch; only the candidate is kept
+            ice_coalescer.add((from_id, target_id, data.get("call_uuid")), data.get("candidate"))
+        elif emit_to_user("webrtc_ice_candidate", data, target_id):
+            ice_log.info(f"✅ ICE candidate sent to {target_id}")
         else:
-            logger.warning(f"❌ Target user {target_id} not connected")
+            ice_log.warning(f"❌ Target user {target_id} not connected")
             
     except Exception as e:
-        logger.exception(f"❌ Error in webrtc_ice_candidate: {e}")
+        ice_log.exception(f"❌ Error in webrtc_ice_candidate: {e}")
 
 @socketio.on("join_call_room")
+@acting_as("user_id")
 def handle_join_call_room(data):
     try:
         call_uuid = data.get("call_uuid")
         user_id = data.get("user_id")
+
+        participants = call_participants(call_uuid)
+        if participants is None or user_id is None or int(user_id) not in participants:
+            logger.warning(f"⚠️ User {user_id} tried to join call room {call_uuid}")
+            emit("error", {"message": "Not a participant of this call"}, room=request.sid)
+            return
         
         call_room = get_call_room(call_uuid)
         join_room(call_room)
@@ -388,10 +1082,11 @@ def handle_join_call_room(data):
         logger.info(f"   Users in call room: {call_room_users[call_uuid]}")
         
         # Check if both users are now in the call room
-        if call_uuid in active_calls:
-            caller_id = active_calls[call_uuid]['caller_id']
-            receiver_id = active_calls[call_uuid]['receiver_id']
-            call_type = active_calls[call_uuid].get('call_type', 'video')
+        state = call_tracker.get(call_uuid)
+        if state is not None:
+            caller_id = state.caller_id
+            receiver_id = state.receiver_id
+            call_type = state.call_type
             
             # Check if both users are present
             users_in_room = call_room_users.get(call_uuid, [])
@@ -419,6 +1114,7 @@ def handle_join_call_room(data):
         logger.exception(f"❌ Error joining call room: {e}")
 
 @socketio.on("leave_call_room")
+@acting_as("user_id")
 def handle_leave_call_room(data):
     try:
         call_uuid = data.get("call_uuid")
@@ -433,42 +1129,27 @@ def handle_leave_call_room(data):
         logger.exception(f"❌ Error leaving call room: {e}")
 
 @socketio.on("end_call")
+@acting_as("from")
 def handle_end_call(data):
     try:
         call_uuid = data.get("call_uuid")
         from_id = data.get("from")
-        to_id = data.get("to")
         
         logger.info(f"⛔ Ending call: {call_uuid}")
+
+        participants = call_participants(call_uuid)
+        if participants is None or from_id is None or int(from_id) not in participants:
+            logger.warning(f"⚠️ User {from_id} tried to end call {call_uuid}")
+            emit("error", {"message": "Not a participant of this call"}, room=request.sid)
+            return
         
-        call = Call.query.filter_by(call_uuid=call_uuid).first()
-        if call:
-            call.status = "ended"
-            call.ended_at = datetime.now(timezone.utc)
-            db.session.commit()
+        if close_call(call_uuid):
             logger.info(f"✅ Call {call_uuid} marked as ended")
 
-        if call_uuid in active_calls:
-            del active_calls[call_uuid]
-        
-        # Clean up call room users tracking
-        if call_uuid in call_room_users:
-            del call_room_users[call_uuid]
+        release_call(call_uuid)
 
-        caller_sid = connected_users.get(str(from_id))
-        callee_sid = connected_users.get(str(to_id))
-        
-        if caller_sid:
-            emit("call_ended", {
-                "from": from_id, 
-                "call_uuid": call_uuid
-            }, room=caller_sid)
-            
-        if callee_sid:
-            emit("call_ended", {
-                "from": from_id, 
-                "call_uuid": call_uuid
-            }, room=callee_sid)
+        # Notify the call's participants, not whoever the client named in "to"
+        notify_call_ended(call_uuid, from_id, set(participants), 'hangup')
         
         logger.info(f"✅ Call ended notifications sent")
             
@@ -477,24 +1158,22 @@ def handle_end_call(data):
 
 # TYPING INDICATORS
 @socketio.on("typing")
+@acting_as("sender_id")
 def handle_typing(data):
     try:
         sender_id = int(data["sender_id"])
         receiver_id = int(data["receiver_id"])
-        is_typing = data.get("typing", False)
+        is_typing = bool(data.get("typing", False))
         
         room = get_chat_room(sender_id, receiver_id)
-        emit("typing", {
-            "sender_id": sender_id,
-            "receiver_id": receiver_id,
-            "typing": is_typing
-        }, to=room, skip_sid=request.sid)
+        typing_tracker.update(sender_id, receiver_id, room, is_typing, sid=request.sid)
         
     except Exception as e:
-        logger.exception(f"❌ Error in typing: {e}")
+        typing_log.exception(f"❌ Error in typing: {e}")
 
 # USER STATUS UPDATES
 @socketio.on("update_user_status")
+@acting_as("user_id")
 def handle_update_user_status(data):
     try:
         user_id = int(data["user_id"])
@@ -511,18 +1190,72 @@ def handle_update_user_status(data):
         logger.exception(f"❌ Error updating user status: {e}")
 
 # MESSAGE READ RECEIPTS
+# Accepts a single "message_id", a batch of "message_ids" or an "up_to_message_id";
+# all of them advance the reader's watermark for the conversation to the highest id.
 @socketio.on("mark_message_read")
+@acting_as("receiver_id")
 def handle_mark_message_read(data):
     try:
-        message_id = int(data["message_id"])
-        receiver_id = int(data["receiver_id"])
-        
+        reader_id = int(data["receiver_id"])
+        if "up_to_message_id" in data:
+            message_id = int(data["up_to_message_id"])
+        elif "message_ids" in data:
+            if not data["message_ids"]:
+                emit("error", {"message": "message_ids is empty"}, room=request.sid)
+                return
+            message_id = max(int(m) for m in data["message_ids"])
+        else:
+            message_id = int(data["message_id"])
+
+        msg = db.session.get(Message, message_id)
+        if msg is not None:
+            if reader_id not in (msg.sender_id, msg.receiver_id):
+                emit("error", {"message": "Not a participant of this conversation"}, room=request.sid)
+                return
+            other_id = msg.sender_id if msg.receiver_id == reader_id else msg.receiver_id
+        elif (app.config['MESSAGE_WRITE_BEHIND'] and "sender_id" in data
+                and is_allocated_message_id(message_id)):
+            # Handed out but not committed yet; trust the client-supplied peer
+            other_id = int(data["sender_id"])
+        else:
+            emit("error", {"message": "Unknown message"}, room=request.sid)
+            return
+
+        conversation_key = get_conversation_key(reader_id, other_id)
+        receipt = db.session.get(ReadReceipt, (reader_id, conversation_key))
+        if receipt is None:
+            receipt = ReadReceipt(user_id=reader_id, conversation_key=conversation_key, last_read_message_id=0)
+            db.session.add(receipt)
+        if message_id <= receipt.last_read_message_id:
+            # Watermarks only move forward; nothing new to tell the room
+            db.session.rollback()
+            return
+        receipt.last_read_message_id = message_id
+        receipt.updated_at = datetime.now(timezone.utc)
+
+        # Recount what is still unread after the watermark (only the unread tail is scanned)
+        unread = Message.query.filter(
+            Message.conversation_key == conversation_key,
+            Message.receiver_id == reader_id,
+            Message.sender_id != reader_id
+        )
+        if msg is not None:
+            unread = unread.filter(db.tuple_(Message.timestamp, Message.id) > (msg.timestamp, msg.id))
+        else:
+            unread = unread.filter(Message.id > message_id)
+        ConversationSummary.query.filter_by(
+            user_id=reader_id, conversation_key=conversation_key
+        ).update({'unread_count': unread.count()})
+        db.session.commit()
+
         emit("message_read", {
             "message_id": message_id,
-            "read_by": receiver_id
-        }, broadcast=True)
+            "up_to_message_id": message_id,
+            "read_by": reader_id
+        }, to=get_chat_room(reader_id, other_id))
         
     except Exception as e:
+        db.session.rollback()
         logger.exception(f"❌ Error marking message as read: {e}")
 
 # HTTP ROUTES
@@ -532,55 +1265,276 @@ def index():
         "message": "Chat Server is running", 
         "status": "healthy",
         "timestamp": datetime.now(timezone.utc).isoformat(),
-        "connected_users": len(connected_users),
-        "active_calls": len(active_calls)
+        "connected_users": len(presence),
+        "active_calls": len(call_tracker)
     })
 
 @app.route('/messages/<int:user1>/<int:user2>', methods=['GET'])
 def get_message_history(user1, user2):
+    """Keyset-paginated history, oldest first within a page.
+
+    Without a cursor the newest page is returned. ``before=<id>`` pages back
+    towards older messages and ``after=<id>`` fetches anything newer (for
+    catching up after a reconnect). The cursor for the next page is returned
+    in the ``X-Next-Before`` / ``X-Next-After`` headers.
+    """
     try:
-        messages = Message.query.filter(
-            ((Message.sender_id == user1) & (Message.receiver_id == user2)) |
-            ((Message.sender_id == user2) & (Message.receiver_id == user1))
-        ).order_by(Message.timestamp.asc()).all()
-        
-        result = []
-        for msg in messages:
-            result.append({
-                'id': msg.id,
-                'sender_id': msg.sender_id,
-                'receiver_id': msg.receiver_id,
-                'message': msg.message,
-                'timestamp': msg.timestamp.isoformat()
-            })
-        
+        before_id = request.args.get('before', type=int)
+        after_id = request.args.get('after', type=int)
+        limit = request.args.get('limit', MESSAGE_PAGE_SIZE, type=int)
+        if before_id is not None and after_id is not None:
+            return jsonify({'error': 'Use either before or after, not both'}), 400
+        if limit < 1:
+            return jsonify({'error': 'limit must be positive'}), 400
+        limit = min(limit, MESSAGE_PAGE_MAX)
+
+        conversation_key = get_conversation_key(user1, user2)
+        if (before_id is None and after_id is None and history_cache is not None
+                and limit <= history_cache.tail_size):
+            return cached_history_response(conversation_key, limit)
+
+        query = Message.query.filter(Message.conversation_key == conversation_key)
+        cursor_id = before_id if before_id is not None else after_id
+
+        if cursor_id is not None:
+            cursor = Message.query.filter_by(id=cursor_id, conversation_key=conversation_key).first()
+            if not cursor:
+                return jsonify({'error': 'Unknown cursor message'}), 400
+            position = db.tuple_(Message.timestamp, Message.id)
+            if after_id is not None:
+                query = query.filter(position > (cursor.timestamp, cursor.id))
+            else:
+                query = query.filter(position < (cursor.timestamp, cursor.id))
+
+        # Fetch one extra row to learn whether another page exists
+        if after_id is not None:
+            rows = query.order_by(Message.timestamp.asc(), Message.id.asc()).limit(limit + 1).all()
+            has_more = len(rows) > limit
+            messages = rows[:limit]
+        else:
+            rows = query.order_by(Message.timestamp.desc(), Message.id.desc()).limit(limit + 1).all()
+            has_more = len(rows) > limit
+            messages = list(reversed(rows[:limit]))
+
+        result = [serialize_message(msg) for msg in messages]
+
         logger.info(f"✅ Fetched {len(result)} messages for users {user1} and {user2}")
-        return jsonify(result)
+        response = jsonify(result)
+        response.headers['X-Has-More'] = 'true' if has_more else 'false'
+        if messages:
+            response.headers['X-Next-Before'] = str(messages[0].id)
+            response.headers['X-Next-After'] = str(messages[-1].id)
+        return response
         
     except Exception as e:
         logger.exception(f"❌ Error fetching message history: {e}")
         return jsonify({'error': 'Failed to fetch messages'}), 500
 
-@app.route('/calls', methods=['GET'])
-def get_calls():
+@app.route('/messages/search', methods=['GET'])
+def search_messages():
+    """Messages sent or received by ``user_id`` that contain every word of ``q``.
+
+    Best matches first, each with an HTML-escaped ``snippet`` that wraps the
+    matched words in ``<mark>``. The next page is fetched with
+    ``cursor=<X-Next-Cursor>``.
+    """
     try:
-        calls = Call.query.order_by(Call.started_at.desc()).limit(50).all()
+        user_id = request.args.get('user_id', type=int)
+        query = request.args.get('q', '').strip()
+        limit = request.args.get('limit', SEARCH_PAGE_SIZE, type=int)
+        if user_id is None or not query:
+            return jsonify({'error': 'user_id and q are required'}), 400
+        if limit < 1:
+            return jsonify({'error': 'limit must be positive'}), 400
+        limit = min(limit, MESSAGE_PAGE_MAX)
+        cursor = None
+        if request.args.get('cursor'):
+            try:
+                cursor = message_search.decode_cursor(request.args['cursor'])
+            except ValueError:
+                return jsonify({'error': 'Invalid cursor'}), 400
+
+        rows, has_more = message_search.search(db.session, user_id, query, limit, cursor)
+        result = [{
+            'id': row['id'],
+            'sender_id': row['sender_id'],
+            'receiver_id': row['receiver_id'],
+            'timestamp': row['timestamp'].isoformat(),
+            'snippet': message_search.highlight(row['snippet'])
+        } for row in rows]
+
+        response = jsonify(result)
+        response.headers['X-Has-More'] = 'true' if has_more else 'false'
+        if rows:
+            response.headers['X-Next-Cursor'] = message_search.encode_cursor(rows[-1])
+        return response
+    except Exception as e:
+        logger.exception(f"❌ Error searching messages: {e}")
+        return jsonify({'error': 'Failed to search messages'}), 500
+
+def cached_history_response(conversation_key, limit):
+    """Newest page served from the tail cache, with ETag/Last-Modified validators."""
+    entry = history_cache.get(conversation_key)
+    if entry is None:
+        rows = Message.query.filter(
+            Message.conversation_key == conversation_key
+        ).order_by(Message.timestamp.desc(), Message.id.desc()).limit(history_cache.tail_size + 1).all()
+        messages = [serialize_message(msg) for msg in reversed(rows)]
+        entry = history_cache.put(conversation_key, messages, complete=len(rows) <= history_cache.tail_size)
+
+    etag = f"{conversation_key}.{entry.last_id}.{limit}"
+    last_modified = None
+    if entry.messages:
+        last_modified = datetime.fromisoformat(entry.messages[-1]['timestamp']).replace(tzinfo=timezone.utc)
+
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+
+    messages = entry.messages[-limit:]
+    response = jsonify(messages)
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.headers['X-Has-More'] = 'true' if len(entry.messages) > limit or not entry.complete else 'false'
+    if messages:
+        response.headers['X-Next-Before'] = str(messages[0]['id'])
+        response.headers['X-Next-After'] = str(messages[-1]['id'])
+    # Also answers If-Modified-Since
+    return response.make_conditional(request)
+
+@app.route('/messages/<int:user1>/<int:user2>/read', methods=['GET'])
+def get_read_watermarks(user1, user2):
+    try:
+        conversation_key = get_conversation_key(user1, user2)
+        receipts = ReadReceipt.query.filter(
+            ReadReceipt.conversation_key == conversation_key,
+            ReadReceipt.user_id.in_([user1, user2])
+        ).all()
+        watermarks = {str(user1): 0, str(user2): 0}
+        for receipt in receipts:
+            watermarks[str(receipt.user_id)] = receipt.last_read_message_id
+        return jsonify({'conversation': conversation_key, 'last_read_message_id': watermarks})
+    except Exception as e:
+        logger.exception(f"❌ Error fetching read receipts: {e}")
+        return jsonify({'error': 'Failed to fetch read receipts'}), 500
+
+@app.route('/conversations/<int:user_id>', methods=['GET'])
+def get_conversations(user_id):
+    """Inbox for ``user_id``, most recently active first.
+
+    Pages back with ``before=<last_message_id>``; the next cursor is returned
+    in ``X-Next-Before``.
+    """
+    try:
+        before_id = request.args.get('before', type=int)
+        limit = request.args.get('limit', MESSAGE_PAGE_SIZE, type=int)
+        if limit < 1:
+            return jsonify({'error': 'limit must be positive'}), 400
+        limit = min(limit, MESSAGE_PAGE_MAX)
+
+        query = ConversationSummary.query.filter(ConversationSummary.user_id == user_id)
+        if before_id is not None:
+            query = query.filter(ConversationSummary.last_message_id < before_id)
+        rows = query.order_by(ConversationSummary.last_message_id.desc()).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
         result = []
-        for call in calls:
+        for summary in rows:
             result.append({
-                'id': call.id,
-                'caller_id': call.caller_id,
-                'receiver_id': call.receiver_id,
-                'call_uuid': call.call_uuid,
-                'status': call.status,
-                'started_at': call.started_at.isoformat() if call.started_at else None,
-                'ended_at': call.ended_at.isoformat() if call.ended_at else None
+                'conversation': summary.conversation_key,
+                'peer_id': summary.peer_id,
+                'unread_count': summary.unread_count,
+                'last_message': {
+                    'id': summary.last_message_id,
+                    'sender_id': summary.last_sender_id,
+                    'message': summary.last_message,
+                    'timestamp': summary.last_timestamp.isoformat() if summary.last_timestamp else None
+                }
             })
-        return jsonify(result)
+
+        response = jsonify(result)
+        response.headers['X-Has-More'] = 'true' if has_more else 'false'
+        if rows:
+            response.headers['X-Next-Before'] = str(rows[-1].last_message_id)
+        return response
+    except Exception as e:
+        logger.exception(f"❌ Error fetching conversations: {e}")
+        return jsonify({'error': 'Failed to fetch conversations'}), 500
+
+@app.route('/calls', methods=['GET'])
+def get_calls():
+    """Call log, newest first.
+
+    With ``user_id`` only calls that user placed or received are listed, by
+    ``started_at``; without it, all calls by id. Page back with
+    ``before=<call id>``; the next cursor is returned in ``X-Next-Before``.
+    """
+    try:
+        user_id = request.args.get('user_id', type=int)
+        before_id = request.args.get('before', type=int)
+        limit = request.args.get('limit', CALL_PAGE_SIZE, type=int)
+        if limit < 1:
+            return jsonify({'error': 'limit must be positive'}), 400
+        limit = min(limit, MESSAGE_PAGE_MAX)
+
+        if user_id is None:
+            query = Call.query
+            if before_id is not None:
+                query = query.filter(Call.id < before_id)
+            rows = query.order_by(Call.id.desc()).limit(limit + 1).all()
+        else:
+            position = db.tuple_(Call.started_at, Call.id)
+            cursor = None
+            if before_id is not None:
+                cursor = db.session.get(Call, before_id)
+                if cursor is None or user_id not in (cursor.caller_id, cursor.receiver_id):
+                    return jsonify({'error': 'Unknown cursor call'}), 400
+            # One range scan per side of the call, each on its own index, then merged
+            rows = []
+            for column in (Call.caller_id, Call.receiver_id):
+                query = Call.query.filter(column == user_id)
+                if cursor is not None:
+                    query = query.filter(position < (cursor.started_at, cursor.id))
+                rows.extend(query.order_by(Call.started_at.desc(), Call.id.desc()).limit(limit + 1).all())
+            rows = sorted(set(rows), key=lambda call: (call.started_at or datetime.min, call.id), reverse=True)
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        result = [serialize_call(call) for call in rows]
+
+        response = jsonify(result)
+        response.headers['X-Has-More'] = 'true' if has_more else 'false'
+        if rows:
+            response.headers['X-Next-Before'] = str(rows[-1].id)
+        return response
     except Exception as e:
         logger.exception(f"❌ Error fetching calls: {e}")
         return jsonify({'error': 'Failed to fetch calls'}), 500
 
+@app.route('/calls/<int:user_id>/stats', methods=['GET'])
+def get_call_stats(user_id):
+    try:
+        stats = db.session.get(CallStats, user_id)
+        made = stats.calls_made if stats else 0
+        received = stats.calls_received if stats else 0
+        answered = stats.answered if stats else 0
+        total = stats.total_duration_seconds if stats else 0.0
+        return jsonify({
+            'user_id': user_id,
+            'calls': made + received,
+            'calls_made': made,
+            'calls_received': received,
+            'answered': answered,
+            'missed': stats.missed if stats else 0,
+            'total_duration_seconds': round(total, 1),
+            'average_duration_seconds': round(total / answered, 1) if answered else 0.0
+        })
+    except Exception as e:
+        logger.exception(f"❌ Error fetching call stats: {e}")
+        return jsonify({'error': 'Failed to fetch call stats'}), 500
+
 @app.route('/health', methods=['GET'])
 def health_check():
     return jsonify({
@@ -590,13 +1544,17 @@ def health_check():
         "version": "1.0"
     })
 
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(registry.render(), content_type=metrics.CONTENT_TYPE)
+
 @app.route('/users/online', methods=['GET'])
 def get_online_users():
     try:
         online_users = []
-        for user_id, sid in connected_users.items():
+        for user_id in presence.online_users():
             online_users.append({
-                'user_id': int(user_id),
+                'user_id': user_id,
                 'connected_at': 'active'
             })
         return jsonify({
@@ -607,6 +1565,61 @@ def get_online_users():
         logger.exception(f"❌ Error fetching online users: {e}")
         return jsonify({'error': 'Failed to fetch online users'}), 500
 
+# PROFILING
+@app.route('/admin/profile', methods=['POST'])
+def profile_server():
+    token = app.config['ADMIN_TOKEN']
+    if not token or not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), token):
+        return jsonify({'error': 'Endpoint not found'}), 404
+
+    seconds = min(request.args.get('seconds', app.config['PROFILE_SECONDS'], type=float), PROFILE_MAX_SECONDS)
+    interval = request.args.get('interval_ms', 5, type=float) / 1000.0
+    output = request.args.get('format', 'collapsed')
+    if output not in ('collapsed', 'pstats', 'prof', 'events'):
+        return jsonify({'error': 'format must be collapsed, pstats, prof or events'}), 400
+    try:
+        session = profiler.start(seconds, interval, include_idle=request.args.get('idle') == '1')
+    except profiler.ProfilerBusy:
+        return jsonify({'error': 'A profile is already running'}), 409
+
+    logger.warning(f"🔬 Profiling for {seconds}s at {interval * 1000:.1f}ms intervals")
+    while not session.done:
+        socketio.sleep(0.1)
+
+    if output == 'pstats':
+        return Response(session.pstats_text(request.args.get('sort', 'cumulative')), mimetype='text/plain')
+    if output == 'prof':
+        return Response(session.pstats_dump(), mimetype='application/octet-stream',
+                        headers={'Content-Disposition': 'attachment; filename=chat.prof'})
+    if output == 'events':
+        return jsonify({
+            'seconds': round(session.elapsed, 3),
+            'samples': session.samples,
+            'idle_samples': session.idle,
+            'events': session.event_summary()
+        })
+    return Response(session.collapsed(), mimetype='text/plain')
+
+def write_profile(session):
+    # Runs on the profiler's own thread once sampling ends
+    directory = tempfile.mkdtemp(prefix='chat-profile-')
+    with open(os.path.join(directory, 'stacks.collapsed'), 'w') as fh:
+        fh.write(session.collapsed())
+    with open(os.path.join(directory, 'chat.prof'), 'wb') as fh:
+        fh.write(session.pstats_dump())
+    with open(os.path.join(directory, 'events.json'), 'w') as fh:
+        json.dump(session.event_summary(), fh, indent=2)
+    logger.warning(f"🔬 Profile written to {directory}")
+
+def handle_profile_signal(signum, frame):
+    try:
+        profiler.start(app.config['PROFILE_SECONDS'], on_done=write_profile)
+    except profiler.ProfilerBusy:
+        logger.warning("🔬 Profile already running")
+
+if hasattr(signal, 'SIGUSR2'):
+    signal.signal(signal.SIGUSR2, handle_profile_signal)
+
 # ERROR HANDLERS
 @app.errorhandler(404)
 def not_found(error):
@@ -622,8 +1635,9 @@ def bad_request(error):
 
 # RUN SERVER
 if __name__ == '__main__':
-    print("🚀 Starting Chat Server on port 5001...")
-    print("📡 Server will be available at: http://192.168.1.69:5001")
+    port = int(os.environ.get('CHAT_PORT', '5001'))
+    print(f"🚀 Starting Chat Server on port {port}...")
+    print(f"📡 Server will be available at: http://0.0.0.0:{port}")
     print("🔧 Using eventlet for WebSocket support")
     print("✅ Call system properly configured with call_type handling")
     print("💡 Features:")
@@ -637,7 +1651,7 @@ if __name__ == '__main__':
         socketio.run(
             app, 
             host='0.0.0.0', 
-            port=5001, 
+            port=port, 
             debug=False,
             use_reloader=False,
             log_output=True
@@ -645,7 +1659,7 @@ if __name__ == '__main__':
     except Exception as e:
         print(f"❌ Failed to start server: {e}")
         print("💡 Troubleshooting tips:")
-        print("   - Check if port 5001 is available")
+        print(f"   - Check if port {port} is available")
         print("   - Ensure eventlet is installed: pip install eventlet")
         print("   - Check firewall settings")
         print("   - Verify network connectivity")
@@ -0,0 +1,118 @@
+import html
+import re
+
+from sqlalchemy import DateTime, text
+
+# Own copy of each message's text plus a "u<sender> u<receiver>" token column,
+# so "messages of user N matching q" is one intersection of posting lists.
+# Triggers keep it in the same transaction as every write to message, on both
+# the direct and the write-behind (batched insert) paths.
+SCHEMA = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS message_fts USING fts5(
+        message, participants, tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS message_fts_insert AFTER INSERT ON message BEGIN
+        INSERT INTO message_fts (rowid, message, participants)
+        VALUES (new.id, new.message, 'u' || new.sender_id || ' u' || new.receiver_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS message_fts_update AFTER UPDATE OF message, sender_id, receiver_id
+    ON message BEGIN
+        UPDATE message_fts
+        SET message = new.message, participants = 'u' || new.sender_id || ' u' || new.receiver_id
+        WHERE rowid = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS message_fts_delete AFTER DELETE ON message BEGIN
+        DELETE FROM message_fts WHERE rowid = old.id;
+    END
+    """,
+]
+
+# Only the message text counts towards relevance
+RANK = "INSERT INTO message_fts (message_fts, rank) VALUES ('rank', 'bm25(1.0, 0.0)')"
+
+# Matches are marked with private-use characters so the snippet can be
+# HTML-escaped before the markers become <mark> tags
+_MARK_START, _MARK_END = '\ue000', '\ue001'
+_TERM = re.compile(r'\w+', re.UNICODE)
+
+
+def ensure_index(session):
+    """Create the index and its triggers if missing; True if it was just created."""
+    exists = session.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'message_fts'"
+    )).first() is not None
+    for statement in SCHEMA:
+        session.execute(text(statement))
+    if not exists:
+        session.execute(text(RANK))
+    return not exists
+
+
+def rebuild(session):
+    """Re-index every message from scratch (caller commits)."""
+    session.execute(text("DELETE FROM message_fts"))
+    session.execute(text("""
+        INSERT INTO message_fts (rowid, message, participants)
+        SELECT id, message, 'u' || sender_id || ' u' || receiver_id FROM message
+    """))
+    session.execute(text("INSERT INTO message_fts (message_fts) VALUES ('optimize')"))
+
+
+def match_expression(query, user_id):
+    """FTS5 query for ``query`` as plain words; the last one also matches as a prefix.
+
+    Words are quoted, so FTS5 operators typed by users are searched literally.
+    Returns None when ``query`` has no searchable words.
+    """
+    terms = _TERM.findall(query)
+    if not terms:
+        return None
+    words = ' '.join(f'"{term}"' for term in terms) + '*'
+    return f'participants : "u{int(user_id)}" AND message : ({words})'
+
+
+def search(session, user_id, query, limit, cursor=None):
+    """Matching messages of ``user_id``, best first, as ``(rows, has_more)``.
+
+    ``cursor`` is the ``(rank, id)`` of the last row of the previous page.
+    Rank is recomputed per request, so messages arriving between pages can
+    shift it slightly.
+    """
+    expression = match_expression(query, user_id)
+    if expression is None:
+        return [], False
+    params = {'match': expression, 'limit': limit + 1}
+    after = ''
+    if cursor is not None:
+        after = 'AND (message_fts.rank, message_fts.rowid) > (:rank, :id)'
+        params['rank'], params['id'] = cursor
+    rows = session.execute(text(f"""
+        SELECT m.id, m.sender_id, m.receiver_id, m.timestamp, message_fts.rank AS rank,
+               snippet(message_fts, 0, '{_MARK_START}', '{_MARK_END}', '…', 12) AS snippet
+        FROM message_fts JOIN message m ON m.id = message_fts.rowid
+        WHERE message_fts MATCH :match {after}
+        ORDER BY message_fts.rank, message_fts.rowid
+        LIMIT :limit
+    """).columns(timestamp=DateTime), params).mappings().all()
+    return rows[:limit], len(rows) > limit
+
+
+def highlight(snippet):
+    """HTML-escape a snippet and wrap the matched words in ``<mark>``."""
+    return html.escape(snippet).replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>')
+
+
+def encode_cursor(row):
+    return f"{row['rank']!r}:{row['id']}"
+
+
+def decode_cursor(value):
+    rank, _, message_id = value.rpartition(':')
+    return float(rank), int(message_id)
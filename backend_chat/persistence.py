@@ -0,0 +1,129 @@
+"""SQLite tuning used by my_auth_backend and backend_chat.
+
+Each service carries an identical copy of this module, so either one can be
+deployed from its own directory, and builds its Flask-SQLAlchemy handle with
+``create_db``. Every setting can be overridden
+per service with ``<PREFIX>SQLITE_<NAME>`` environment variables, e.g.
+``AUTH_SQLITE_BUSY_TIMEOUT_MS=10000`` or ``CHAT_SQLITE_READ_ROUTING=0``.
+"""
+import os
+
+from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.sql import Select
+
+READ_BIND = 'read'
+_WROTE = 'persistence.wrote'
+
+DEFAULTS = {
+    # WAL lets readers run alongside the single writer; NORMAL only syncs at
+    # checkpoints, which is durable against process crashes (not power loss)
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    # How long a connection waits for the write lock before "database is locked"
+    'busy_timeout_ms': 15000,
+    'mmap_size': 256 * 1024 * 1024,
+    # Page cache per connection, in KiB
+    'cache_size_kib': 16 * 1024,
+    'pool_size': 5,
+    'max_overflow': 10,
+    'pool_timeout': 10,
+    'read_pool_size': 10,
+    'read_routing': True,
+}
+
+
+def settings_from_env(prefix, **overrides):
+    settings = dict(DEFAULTS, **overrides)
+    for name, default in settings.items():
+        value = os.environ.get(f'{prefix}SQLITE_{name.upper()}')
+        if value is None:
+            continue
+        if isinstance(default, bool):
+            settings[name] = value == '1'
+        elif isinstance(default, int):
+            settings[name] = int(value)
+        else:
+            settings[name] = value.upper()
+    return settings
+
+
+def is_sqlite_file(uri):
+    url = make_url(uri)
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:')
+
+
+class RoutingSession(Session):
+    """Sends SELECTs to the read engine until the transaction writes.
+
+    Once a transaction has flushed or executed anything other than a plain
+    SELECT, its remaining queries stay on the write connection so they see
+    its own uncommitted rows. The flag clears when the transaction ends.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and READ_BIND in self._db.engines:
+            if isinstance(clause, Select) and not self._flushing and not self.info.get(_WROTE):
+                return self._db.engines[READ_BIND]
+            self.info[_WROTE] = True
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'after_transaction_end')
+def _reset_routing(session, transaction):
+    if transaction.parent is None:
+        session.info.pop(_WROTE, None)
+
+
+def _pragmas(settings, read_only):
+    pragmas = [
+        f"PRAGMA busy_timeout = {int(settings['busy_timeout_ms'])}",
+        f"PRAGMA journal_mode = {settings['journal_mode']}",
+        f"PRAGMA synchronous = {settings['synchronous']}",
+        f"PRAGMA mmap_size = {int(settings['mmap_size'])}",
+        f"PRAGMA cache_size = {-int(settings['cache_size_kib'])}",
+        "PRAGMA temp_store = MEMORY",
+    ]
+    if read_only:
+        pragmas.append("PRAGMA query_only = ON")
+
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+    return on_connect
+
+
+def create_db(app, settings=None):
+    """Flask-SQLAlchemy handle for ``app`` with the tuned SQLite engines.
+
+    Non-SQLite and in-memory databases get a plain handle. Otherwise writes
+    use a pool of ``pool_size`` connections and, with ``read_routing``, plain
+    SELECTs go to a second pool of ``query_only`` connections to the same file.
+    """
+    settings = settings or dict(DEFAULTS)
+    uri = app.config['SQLALCHEMY_DATABASE_URI']
+    if not is_sqlite_file(uri):
+        return SQLAlchemy(app)
+
+    if settings['read_routing']:
+        binds = app.config.setdefault('SQLALCHEMY_BINDS', {})
+        binds[READ_BIND] = {'url': uri, 'pool_size': settings['read_pool_size']}
+    db = SQLAlchemy(
+        app,
+        engine_options={
+            'pool_size': settings['pool_size'],
+            'max_overflow': settings['max_overflow'],
+            'pool_timeout': settings['pool_timeout'],
+            'connect_args': {'timeout': settings['busy_timeout_ms'] / 1000},
+        },
+        session_options={'class_': RoutingSession},
+    )
+    with app.app_context():
+        for bind_key, engine in db.engines.items():
+            event.listen(engine, 'connect', _pragmas(settings, read_only=bind_key == READ_BIND))
+    return db
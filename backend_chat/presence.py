@@ -0,0 +1,74 @@
+class PresenceRegistry:
+    """Indexes of who is connected and which calls they are part of.
+
+    Every lookup the socket handlers need (sid -> user, user -> sids,
+    user -> active calls) is a dict access, so connect/disconnect storms stay
+    linear in the number of events instead of the number of sockets.
+    A user may be connected from several devices at once.
+    """
+
+    def __init__(self):
+        self._user_by_sid = {}
+        self._sids_by_user = {}
+        self._calls_by_user = {}
+        self._features_by_sid = {}
+
+    def connect(self, user_id, sid, features=()):
+        self._user_by_sid[sid] = user_id
+        self._sids_by_user.setdefault(user_id, set()).add(sid)
+        if features:
+            self._features_by_sid[sid] = frozenset(features)
+
+    def disconnect(self, sid):
+        """Forget ``sid``; returns ``(user_id, went_offline)``."""
+        user_id = self._user_by_sid.pop(sid, None)
+        self._features_by_sid.pop(sid, None)
+        if user_id is None:
+            return None, False
+        sids = self._sids_by_user.get(user_id)
+        if sids is not None:
+            sids.discard(sid)
+            if not sids:
+                del self._sids_by_user[user_id]
+                return user_id, True
+        return user_id, False
+
+    def user_for(self, sid):
+        return self._user_by_sid.get(sid)
+
+    def sids_for(self, user_id):
+        return self._sids_by_user.get(user_id, set())
+
+    def supports(self, user_id, feature):
+        """True when every connected device of ``user_id`` declared ``feature``."""
+        sids = self._sids_by_user.get(user_id)
+        if not sids:
+            return False
+        return all(feature in self._features_by_sid.get(sid, ()) for sid in sids)
+
+    def is_online(self, user_id):
+        return user_id in self._sids_by_user
+
+    def online_users(self):
+        return list(self._sids_by_user)
+
+    def connection_count(self):
+        return len(self._user_by_sid)
+
+    def __len__(self):
+        return len(self._sids_by_user)
+
+    def add_call(self, call_uuid, *user_ids):
+        for user_id in user_ids:
+            self._calls_by_user.setdefault(user_id, set()).add(call_uuid)
+
+    def remove_call(self, call_uuid, *user_ids):
+        for user_id in user_ids:
+            calls = self._calls_by_user.get(user_id)
+            if calls is not None:
+                calls.discard(call_uuid)
+                if not calls:
+                    del self._calls_by_user[user_id]
+
+    def calls_for(self, user_id):
+        return set(self._calls_by_user.get(user_id, ()))
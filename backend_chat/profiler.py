@@ -0,0 +1,213 @@
+import io
+import marshal
+import os
+import pstats
+import sys
+from collections import Counter, defaultdict
+
+from log_pipeline import _native
+
+_threading = _native('threading')
+_time = _native('time')
+
+# Innermost frames of threads parked waiting for work; counted as idle
+_IDLE_LEAVES = {
+    ('threading.py', 'wait'), ('queue.py', 'get'), ('selectors.py', 'select'), ('handlers.py', 'dequeue')
+}
+_HUB_DIR = os.sep + os.path.join('eventlet', 'hubs') + os.sep
+
+
+class ProfilerBusy(Exception):
+    """Raised when a profiling session is already running."""
+
+
+def attributed(label, fn, *args):
+    """Call ``fn``; samples taken anywhere below this call are tagged ``label``."""
+    return fn(*args)
+
+
+_ATTRIBUTED_CODE = attributed.__code__
+
+
+class ProfileSession:
+    """Samples the Python stacks of every OS thread from a native thread.
+
+    Under eventlet all greenlets share the main thread, so each sample shows
+    the greenlet holding the hub at that moment: the one burning CPU or
+    blocked in C code (a SQLite commit, a slow log stream). Suspended
+    greenlets cost nothing and are not sampled. Samples where the hub or a
+    worker thread is just waiting for work are counted as idle.
+    """
+
+    def __init__(self, seconds, interval=0.005, include_idle=False):
+        self.seconds = seconds
+        self.interval = interval
+        self.include_idle = include_idle
+        self.stacks = Counter()
+        self.idle = 0
+        self.samples = 0
+        self.elapsed = 0.0
+        self._events = defaultdict(lambda: [0, 0.0, 0.0])
+        self._thread = None
+
+    @property
+    def done(self):
+        return self._thread is not None and not self._thread.is_alive()
+
+    def start(self, on_done=None):
+        self._thread = _threading.Thread(target=self._run, args=(on_done,), name='profiler', daemon=True)
+        self._thread.start()
+
+    def join(self):
+        self._thread.join()
+
+    def _run(self, on_done):
+        global _active
+        me = _threading.get_ident()
+        names = {thread.ident: thread.name for thread in _threading.enumerate()}
+        started = _time.perf_counter()
+        deadline = started + self.seconds
+        try:
+            while _time.perf_counter() < deadline:
+                for ident, frame in sys._current_frames().items():
+                    if ident != me:
+                        self._sample(names.get(ident, f'thread-{ident}'), frame)
+                _time.sleep(self.interval)
+        finally:
+            self.elapsed = _time.perf_counter() - started
+            with _lock:
+                _active = None
+            if on_done is not None:
+                on_done(self)
+
+    def _sample(self, thread_name, frame):
+        leaf = frame.f_code
+        if not self.include_idle and (
+            _HUB_DIR in leaf.co_filename
+            or (os.path.basename(leaf.co_filename), leaf.co_name) in _IDLE_LEAVES
+        ):
+            self.idle += 1
+            return
+        label = None
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            if code is _ATTRIBUTED_CODE and label is None:
+                label = frame.f_locals.get('label')
+            stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+            frame = frame.f_back
+        stack.reverse()
+        self.stacks[(label or thread_name, tuple(stack))] += 1
+        self.samples += 1
+
+    def record_event(self, label, elapsed):
+        entry = self._events[label]
+        entry[0] += 1
+        entry[1] += elapsed
+        entry[2] = max(entry[2], elapsed)
+
+    @property
+    def sample_seconds(self):
+        """Wall-clock time one sample stands for."""
+        taken = self.samples + self.idle
+        return self.elapsed / taken if taken else self.interval
+
+    def collapsed(self):
+        """Flamegraph input: one ``root;frame;...;leaf count`` line per distinct stack."""
+        lines = []
+        for (root, stack), count in self.stacks.most_common():
+            frames = ';'.join(_frame_label(key) for key in stack)
+            lines.append(f'{root};{frames} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def event_summary(self):
+        """Per-event handler wall-clock time, and the sampled (on-hub) share of it."""
+        sampled = Counter()
+        for (root, _), count in self.stacks.items():
+            sampled[root] += count
+        summary = {}
+        for label, (calls, total, slowest) in sorted(self._events.items(), key=lambda item: -item[1][1]):
+            summary[label] = {
+                'calls': calls,
+                'wall_ms': round(total * 1000, 2),
+                'mean_ms': round(total / calls * 1000, 3),
+                'max_ms': round(slowest * 1000, 2),
+                'sampled_ms': round(sampled[label] * self.sample_seconds * 1000, 2),
+            }
+        return summary
+
+    def pstats_data(self):
+        """Sample counts folded into the dict layout cProfile/pstats use."""
+        unit = self.sample_seconds
+        stats = {}
+        for (_, stack), count in self.stacks.items():
+            seconds = count * unit
+            seen = set()
+            for depth, key in enumerate(stack):
+                entry = stats.setdefault(key, [0, 0, 0.0, 0.0, {}])
+                if key not in seen:
+                    seen.add(key)
+                    entry[0] += count
+                    entry[1] += count
+                    entry[3] += seconds
+                if depth:
+                    edge = entry[4].setdefault(stack[depth - 1], [0, 0, 0.0, 0.0])
+                    edge[0] += count
+                    edge[1] += count
+                    edge[3] += seconds
+            stats[stack[-1]][2] += seconds
+        return {
+            key: (cc, nc, tt, ct, {caller: tuple(edge) for caller, edge in callers.items()})
+            for key, (cc, nc, tt, ct, callers) in stats.items()
+        }
+
+    def pstats_text(self, sort='cumulative', limit=60):
+        if not self.stacks:
+            return f'No busy samples ({self.idle} idle) in {self.elapsed:.1f}s\n'
+        stream = io.StringIO()
+        stats = pstats.Stats(_SampledProfile(self.pstats_data()), stream=stream)
+        stats.sort_stats(sort).print_stats(limit)
+        return stream.getvalue()
+
+    def pstats_dump(self):
+        """Bytes in the ``.prof`` format snakeviz and ``pstats.Stats(path)`` read."""
+        return marshal.dumps(self.pstats_data())
+
+
+class _SampledProfile:
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+def _frame_label(key):
+    filename, line, name = key
+    return f'{name} ({os.path.basename(filename)}:{line})'
+
+
+_lock = _threading.Lock()
+_active = None
+
+
+def start(seconds, interval=0.005, include_idle=False, on_done=None):
+    """Start the (single) profiling session; raises ProfilerBusy if one is running."""
+    global _active
+    # Non-blocking: this may run in a signal handler on the thread holding the lock
+    if not _lock.acquire(blocking=False):
+        raise ProfilerBusy()
+    try:
+        if _active is not None:
+            raise ProfilerBusy()
+        session = _active = ProfileSession(seconds, interval, include_idle)
+    finally:
+        _lock.release()
+    session.start(on_done)
+    return session
+
+
+def record_event(label, elapsed):
+    session = _active
+    if session is not None:
+        session.record_event(label, elapsed)
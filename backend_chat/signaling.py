@@ -0,0 +1,31 @@
+class IceCoalescer:
+    """Buffers trickle ICE candidates per (from, to, call_uuid) for ``window`` seconds.
+
+    The first candidate for a key schedules a flush; candidates arriving before
+    it fires ride along, so a burst of N candidates costs one emit.
+    """
+
+    def __init__(self, window, flush, spawn, sleep):
+        self.window = window
+        self.flush = flush
+        self._spawn = spawn
+        self._sleep = sleep
+        self._pending = {}
+
+    def add(self, key, candidate):
+        batch = self._pending.get(key)
+        if batch is None:
+            self._pending[key] = [candidate]
+            self._spawn(self._flush_later, key)
+        else:
+            batch.append(candidate)
+
+    def discard_call(self, call_uuid):
+        for key in [key for key in self._pending if key[2] == call_uuid]:
+            del self._pending[key]
+
+    def _flush_later(self, key):
+        self._sleep(self.window)
+        candidates = self._pending.pop(key, None)
+        if candidates:
+            self.flush(key, candidates)
@@ -0,0 +1,75 @@
+import hashlib
+import time
+
+
+class SocketAuth:
+    """Verified JWT claims per socket.
+
+    A token's signature is checked once; the decoded claims are cached by the
+    token's SHA-256 digest until the token expires, so reconnects with the
+    same token and per-event authorization are dict lookups.
+    """
+
+    def __init__(self, decode, max_tokens=50000, clock=time.time):
+        self.decode = decode
+        self.max_tokens = max_tokens
+        self.clock = clock
+        self._claims_by_digest = {}
+        self._claims_by_sid = {}
+        self.hits = 0
+        self.misses = 0
+
+    def authenticate(self, sid, token):
+        """Verify ``token`` (or reuse its cached claims) and bind it to ``sid``.
+
+        Raises whatever ``decode`` raises for an invalid or expired token, and
+        ValueError for a token that is not a plain access token.
+        """
+        digest = hashlib.sha256(token.encode('utf-8')).hexdigest()
+        claims = self._lookup(digest)
+        if claims is None:
+            self.misses += 1
+            claims = self.decode(token)
+            # Refresh and password-reset tokens are signed by the same key
+            if claims.get('type') != 'access' or claims.get('reset'):
+                raise ValueError('Only access tokens can open a socket')
+            if len(self._claims_by_digest) >= self.max_tokens:
+                self._prune()
+            self._claims_by_digest[digest] = claims
+        else:
+            self.hits += 1
+        self._claims_by_sid[sid] = claims
+        return claims
+
+    def is_bound(self, sid):
+        return sid in self._claims_by_sid
+
+    def claims(self, sid):
+        """Claims for the token ``sid`` connected with; None once it has expired."""
+        claims = self._claims_by_sid.get(sid)
+        if claims is None or self._expired(claims):
+            return None
+        return claims
+
+    def release(self, sid):
+        self._claims_by_sid.pop(sid, None)
+
+    def _expired(self, claims):
+        return claims.get('exp') is not None and claims['exp'] <= self.clock()
+
+    def _lookup(self, digest):
+        claims = self._claims_by_digest.get(digest)
+        if claims is None:
+            return None
+        if self._expired(claims):
+            del self._claims_by_digest[digest]
+            return None
+        return claims
+
+    def _prune(self):
+        for digest, claims in list(self._claims_by_digest.items()):
+            if self._expired(claims):
+                del self._claims_by_digest[digest]
+        # Still full of live tokens: drop the oldest; they are re-verified on use
+        while len(self._claims_by_digest) >= self.max_tokens:
+            del self._claims_by_digest[next(iter(self._claims_by_digest))]
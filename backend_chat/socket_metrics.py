@@ -0,0 +1,65 @@
+import functools
+import time
+
+from flask_socketio import SocketIO
+
+import metrics
+import profiler
+
+
+class InstrumentedSocketIO(SocketIO):
+    """SocketIO that times every ``on`` handler and records emit fan-out.
+
+    Handler time and the database time spent inside it go to per-event
+    histograms, and to a running profiler session, which also tags its
+    samples with the event name. Fan-out is the number of sockets in the
+    target room on this process; with a message queue, other workers'
+    recipients aren't counted.
+    """
+
+    def __init__(self, app=None, registry=None, **kwargs):
+        registry = registry or metrics.Registry()
+        self.event_seconds = registry.histogram(
+            'chat_socketio_event_duration_seconds', 'Socket.IO event handler wall-clock time', ('event',))
+        self.event_db_seconds = registry.histogram(
+            'chat_socketio_event_db_seconds', 'Database statement time per Socket.IO event', ('event',))
+        self.emit_recipients = registry.histogram(
+            'chat_emit_recipients', 'Local sockets reached per emit', ('event',), buckets=metrics.COUNT_BUCKETS)
+        super().__init__(app, **kwargs)
+
+    def on(self, message, namespace=None):
+        register = super().on(message, namespace)
+
+        def decorator(handler):
+            register(self._timed(message, handler))
+            return handler
+        return decorator
+
+    def _timed(self, event, handler):
+        @functools.wraps(handler)
+        def wrapper(*args):
+            started = time.perf_counter()
+            metrics.reset_db_time()
+            try:
+                return profiler.attributed(event, handler, *args)
+            finally:
+                elapsed = time.perf_counter() - started
+                self.event_seconds.observe(elapsed, event)
+                self.event_db_seconds.observe(metrics.db_time(), event)
+                profiler.record_event(event, elapsed)
+        return wrapper
+
+    def emit(self, event, *args, **kwargs):
+        to = kwargs.get('to') or kwargs.get('room')
+        self.emit_recipients.observe(
+            self._local_recipients(kwargs.get('namespace') or '/', to, kwargs.get('skip_sid')), event)
+        return super().emit(event, *args, **kwargs)
+
+    def _local_recipients(self, namespace, to, skip_sid):
+        if self.server is None:
+            return 0
+        members = self.server.manager.rooms.get(namespace, {}).get(to, ())
+        count = len(members)
+        if skip_sid is not None and skip_sid in members:
+            count -= 1
+        return count
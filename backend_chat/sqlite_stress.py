@@ -0,0 +1,144 @@
+"""Concurrency stress run for the SQLite settings in persistence.py.
+
+Starts several worker processes (like gunicorn workers), each with several
+threads, against one throwaway database and runs a mixed workload: reads of
+a user's newest rows, and writes that check then insert inside one
+transaction (the register/send_message pattern). It runs once with stock
+Flask-SQLAlchemy engines, opening that transaction with a plain (deferred)
+``BEGIN``, and once through ``persistence.create_db`` with ``BEGIN
+IMMEDIATE``. A deferred transaction that reads before it writes can
+deadlock with another writer, which SQLite reports as "database is locked"
+right away instead of waiting out the busy timeout. It prints throughput,
+latency and the number of those errors:
+
+    python backend_chat/sqlite_stress.py --workers 4 --threads 8 --seconds 10
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+import persistence
+
+
+def build_app(path, tuned):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+    db = persistence.create_db(app) if tuned else SQLAlchemy(app)
+
+    class Item(db.Model):
+        id = db.Column(db.Integer, primary_key=True)
+        owner = db.Column(db.Integer, nullable=False, index=True)
+        body = db.Column(db.String(200), nullable=False)
+
+    return app, db, Item
+
+
+def run_thread(app, db, Item, tuned, args, deadline, seed, results):
+    rng = random.Random(seed)
+    begin = text('BEGIN IMMEDIATE' if tuned else 'BEGIN')
+    stats = {'reads': 0, 'writes': 0, 'locked': 0, 'other_errors': 0, 'latencies': []}
+    while time.monotonic() < deadline:
+        owner = rng.randrange(args.owners)
+        started = time.perf_counter()
+        with app.app_context():
+            try:
+                if rng.random() < args.write_ratio:
+                    db.session.execute(begin)
+                    count = db.session.query(Item).filter_by(owner=owner).count()
+                    db.session.add(Item(owner=owner, body=f'item {count} ' + 'x' * 100))
+                    db.session.commit()
+                    stats['writes'] += 1
+                else:
+                    Item.query.filter_by(owner=owner).order_by(Item.id.desc()).limit(50).all()
+                    stats['reads'] += 1
+            except OperationalError as exc:
+                db.session.rollback()
+                stats['locked' if 'locked' in str(exc) else 'other_errors'] += 1
+                continue
+        stats['latencies'].append(time.perf_counter() - started)
+    results.append(stats)
+
+
+def run_worker(path, tuned, args, deadline, seed, queue):
+    app, db, Item = build_app(path, tuned)
+    results = []
+    threads = [
+        threading.Thread(target=run_thread, args=(app, db, Item, tuned, args, deadline, seed * 1000 + i, results))
+        for i in range(args.threads)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    queue.put(results)
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run(tuned, args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'stress.db')
+        app, db, _ = build_app(path, tuned)
+        with app.app_context():
+            db.create_all()
+            # Workers are forked; don't hand them pooled connections
+            for engine in db.engines.values():
+                engine.dispose()
+
+        ctx = multiprocessing.get_context('fork')
+        queue = ctx.Queue()
+        deadline = time.monotonic() + args.seconds
+        procs = [ctx.Process(target=run_worker, args=(path, tuned, args, deadline, i, queue))
+                 for i in range(args.workers)]
+        for proc in procs:
+            proc.start()
+        thread_stats = [stats for _ in procs for stats in queue.get()]
+        for proc in procs:
+            proc.join()
+
+    latencies = [latency for stats in thread_stats for latency in stats['latencies']]
+    totals = {key: sum(stats[key] for stats in thread_stats)
+              for key in ('reads', 'writes', 'locked', 'other_errors')}
+    return dict(
+        mode='tuned' if tuned else 'stock',
+        ops_per_sec=round((totals['reads'] + totals['writes']) / args.seconds, 1),
+        p50_ms=round(percentile(latencies, 0.50) * 1000, 2),
+        p99_ms=round(percentile(latencies, 0.99) * 1000, 2),
+        **totals
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--owners', type=int, default=200)
+    parser.add_argument('--write-ratio', type=float, default=0.3)
+    parser.add_argument('--only', choices=('stock', 'tuned'))
+    args = parser.parse_args()
+
+    reports = [run(mode == 'tuned', args) for mode in ('stock', 'tuned') if args.only in (None, mode)]
+    print(json.dumps(reports, indent=2))
+    if any(report['mode'] == 'tuned' and report['locked'] for report in reports):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+import time
+
+
+class TypingTracker:
+    """Server-side typing state per (sender, room).
+
+    Only transitions are forwarded: the first ``typing: true`` and the final
+    ``typing: false``. While a sender keeps typing, at most one refresh goes
+    out per ``refresh_interval``. A sender that goes quiet for ``timeout``
+    seconds is switched to "not typing" automatically, so clients don't have
+    to send heartbeats or a trailing stop event.
+    """
+
+    def __init__(self, refresh_interval, timeout, emit, spawn, sleep, clock=time.monotonic):
+        self.refresh_interval = refresh_interval
+        self.timeout = timeout
+        self._emit = emit
+        self._spawn = spawn
+        self._sleep = sleep
+        self._clock = clock
+        self._state = {}
+
+    def update(self, sender_id, receiver_id, room, is_typing, sid=None):
+        key = (sender_id, room)
+        entry = self._state.get(key)
+        now = self._clock()
+
+        if not is_typing:
+            if entry is not None:
+                del self._state[key]
+                self._emit(sender_id, receiver_id, room, False, sid)
+            return
+
+        if entry is None:
+            entry = {'receiver_id': receiver_id, 'sid': sid, 'last_seen': now, 'last_emit': now}
+            self._state[key] = entry
+            self._emit(sender_id, receiver_id, room, True, sid)
+            self._spawn(self._expire, key, entry)
+            return
+
+        entry['last_seen'] = now
+        entry['sid'] = sid
+        if now - entry['last_emit'] >= self.refresh_interval:
+            entry['last_emit'] = now
+            self._emit(sender_id, receiver_id, room, True, sid)
+
+    def is_typing(self, sender_id, room):
+        return (sender_id, room) in self._state
+
+    def _expire(self, key, entry):
+        remaining = self.timeout
+        while remaining > 0:
+            self._sleep(remaining)
+            if self._state.get(key) is not entry:
+                # Stopped explicitly (or restarted with a fresh entry)
+                return
+            remaining = entry['last_seen'] + self.timeout - self._clock()
+        del self._state[key]
+        self._emit(key[0], entry['receiver_id'], key[1], False, entry['sid'])
@@ -0,0 +1,89 @@
+import logging
+import queue
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class GroupCommitWriter:
+    """Single background writer that persists queued rows in batched transactions.
+
+    Rows are flushed in submission order, so ids assigned before submit() are
+    committed in the same order they were handed out. A batch is closed once
+    ``window`` seconds have passed since its first row or ``max_batch`` rows
+    are pending, whichever comes first.
+
+    A batch whose flush raises an error ``is_transient`` accepts is retried
+    up to ``retries`` times, backing off from ``retry_delay`` seconds; only
+    then is it handed to ``on_error``.
+    """
+
+    def __init__(self, flush, window=0.02, max_batch=256, on_commit=None, on_error=None,
+                 retries=0, retry_delay=0.05, is_transient=None):
+        self.flush = flush
+        self.window = window
+        self.max_batch = max_batch
+        self.on_commit = on_commit
+        self.on_error = on_error
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.is_transient = is_transient
+        self._queue = queue.Queue()
+        self._running = False
+
+    def start(self, spawn):
+        if self._running:
+            return
+        self._running = True
+        spawn(self._run)
+
+    def submit(self, row, context=None):
+        self._queue.put((row, context))
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def drain(self):
+        """Flush everything still queued from the calling thread (used at shutdown)."""
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self._flush_batch(batch)
+
+    def _run(self):
+        while self._running:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._flush_batch(batch)
+
+    def _flush_batch(self, batch):
+        rows = [row for row, _ in batch]
+        attempt = 0
+        while True:
+            try:
+                self.flush(rows)
+                break
+            except Exception as e:
+                if attempt < self.retries and self.is_transient and self.is_transient(e):
+                    attempt += 1
+                    logger.warning(f"⚠️ Group commit of {len(rows)} rows failed, retry {attempt}/{self.retries}: {e}")
+                    time.sleep(self.retry_delay * 2 ** (attempt - 1))
+                    continue
+                logger.exception(f"❌ Group commit of {len(rows)} rows failed: {e}")
+                if self.on_error:
+                    self.on_error(batch, e)
+                return
+        if self.on_commit:
+            self.on_commit(batch)
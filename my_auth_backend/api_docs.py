@@ -0,0 +1,58 @@
+import json
+import os
+
+from flask import send_from_directory
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+SPEC_FILE = 'openapi.json'
+# flasgger's default spec URL, kept so existing clients keep working
+SPEC_ROUTE = '/apispec_1.json'
+
+
+def build_spec(app):
+    """Parse the YAML docstrings of every view into a Swagger 2.0 document.
+
+    This is the slow part flasgger used to do in every worker; it now runs
+    once, from the ``build-openapi`` command.
+    """
+    from flasgger import Swagger
+
+    swagger = Swagger()
+    swagger.app = app
+    swagger.load_config(app)
+    with app.app_context():
+        return swagger.get_apispecs()
+
+
+def write_spec(app, path=None):
+    path = path or os.path.join(STATIC_DIR, SPEC_FILE)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as fh:
+        json.dump(build_spec(app), fh, indent=2, sort_keys=True)
+        fh.write('\n')
+    return path
+
+
+def load_spec():
+    with open(os.path.join(STATIC_DIR, SPEC_FILE), encoding='utf-8') as fh:
+        return json.load(fh)
+
+
+def init_app(app, ui=False):
+    """Serve the prebuilt spec at SPEC_ROUTE, and Swagger UI at /apidocs/ when ``ui``.
+
+    flasgger is only imported when the UI is enabled.
+    """
+    if not ui:
+        app.add_url_rule(SPEC_ROUTE, 'apispec', lambda: send_from_directory(STATIC_DIR, SPEC_FILE))
+        return None
+
+    from flasgger import Swagger
+
+    class PrebuiltSpecSwagger(Swagger):
+        def get_apispecs(self, endpoint='apispec_1'):
+            if endpoint not in self.apispecs:
+                self.apispecs[endpoint] = load_spec()
+            return self.apispecs[endpoint]
+
+    return PrebuiltSpecSwagger(app)
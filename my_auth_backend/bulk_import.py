@@ -0,0 +1,128 @@
+import csv
+import io
+import json
+
+from sqlalchemy.exc import IntegrityError
+
+REQUIRED_FIELDS = ('username', 'email', 'password')
+
+
+def read_rows(stream, fmt):
+    """Yield user dicts from a binary NDJSON or CSV stream (CSV needs a header row)."""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'csv':
+        yield from csv.DictReader(text)
+        return
+    for line in text:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def import_users(db, User, rows, hash_many, chunk_size=1000):
+    """Insert users in chunked transactions and return a per-row report.
+
+    Each chunk costs one query to find existing usernames/emails, one parallel
+    hashing pass over the rows that will actually be inserted, one multi-row
+    INSERT and one query to read back the new ids.
+    """
+    report = []
+    seen_usernames = set()
+    seen_emails = set()
+    row_number = 0
+
+    for chunk in _chunks(rows, chunk_size):
+        candidates = []
+        for row in chunk:
+            row_number += 1
+            if not isinstance(row, dict) or not all(
+                isinstance(row.get(f), str) and row[f] for f in REQUIRED_FIELDS
+            ):
+                report.append({'row': row_number, 'status': 'invalid',
+                               'reason': 'username, email and password must be non-empty strings'})
+                continue
+            candidates.append((row_number, row))
+
+        usernames = {row['username'] for _, row in candidates}
+        emails = {row['email'] for _, row in candidates}
+        existing = db.session.execute(
+            db.select(User.username, User.email).where(
+                User.username.in_(usernames) | User.email.in_(emails)
+            )
+        ).all()
+        taken_usernames = seen_usernames | {r.username for r in existing}
+        taken_emails = seen_emails | {r.email for r in existing}
+
+        accepted = []
+        for number, row in candidates:
+            if row['username'] in taken_usernames or row['email'] in taken_emails:
+                report.append({'row': number, 'status': 'duplicate',
+                               'username': row['username'], 'email': row['email']})
+                continue
+            taken_usernames.add(row['username'])
+            taken_emails.add(row['email'])
+            accepted.append((number, row))
+
+        if accepted:
+            hashes = hash_many(row['password'] for _, row in accepted)
+            values = [
+                {'username': row['username'], 'email': row['email'], 'password': pwhash}
+                for (_, row), pwhash in zip(accepted, hashes)
+            ]
+            try:
+                db.session.execute(db.insert(User), values)
+                db.session.commit()
+            except IntegrityError:
+                # Someone registered one of these since the lookup; redo the chunk row by row
+                db.session.rollback()
+                accepted = _insert_each(db, User, accepted, values, report)
+            ids = dict(db.session.execute(
+                db.select(User.email, User.id).where(User.email.in_([row['email'] for _, row in accepted]))
+            ).all())
+            for number, row in accepted:
+                report.append({'row': number, 'status': 'created', 'id': ids.get(row['email']),
+                               'username': row['username'], 'email': row['email']})
+
+        seen_usernames.update(usernames)
+        seen_emails.update(emails)
+
+    report.sort(key=lambda entry: entry['row'])
+    return report
+
+
+def _insert_each(db, User, accepted, values, report):
+    """Insert rows one savepoint at a time; conflicting rows are reported as duplicates."""
+    inserted = []
+    for (number, row), value in zip(accepted, values):
+        try:
+            with db.session.begin_nested():
+                db.session.execute(db.insert(User), [value])
+        except IntegrityError:
+            report.append({'row': number, 'status': 'duplicate',
+                           'username': row['username'], 'email': row['email']})
+            continue
+        inserted.append((number, row))
+    db.session.commit()
+    return inserted
+
+
+def summarize(report):
+    summary = {'created': 0, 'duplicate': 0, 'invalid': 0}
+    for entry in report:
+        summary[entry['status']] += 1
+    return summary
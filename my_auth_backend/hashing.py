@@ -0,0 +1,111 @@
+import contextlib
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.security import (
+    DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+)
+
+
+class HashingBusy(Exception):
+    """Raised instead of queueing when the hashing service is saturated."""
+
+
+def normalize_method(method):
+    # Expand werkzeug's shorthands to the full prefix stored in the hash,
+    # so a stored hash can be compared against the configured parameters.
+    if method == 'scrypt':
+        return 'scrypt:32768:8:1'
+    if method == 'pbkdf2':
+        return f'pbkdf2:sha256:{DEFAULT_PBKDF2_ITERATIONS}'
+    if method.startswith('pbkdf2:') and method.count(':') == 1:
+        return f'{method}:{DEFAULT_PBKDF2_ITERATIONS}'
+    return method
+
+
+class PasswordHasher:
+    """Runs password KDFs in a small process pool with bounded admission.
+
+    At most ``workers`` hashes run at once and at most ``max_pending`` more
+    may wait for a free process; anything beyond that raises HashingBusy
+    right away so request threads are never parked behind a login burst.
+    The pool is created lazily per process, after gunicorn has forked.
+    """
+
+    def __init__(self, method='scrypt', salt_length=16, workers=2, max_pending=16):
+        self.method = normalize_method(method)
+        self.salt_length = salt_length
+        self.workers = workers
+        self._slots = threading.BoundedSemaphore(workers + max_pending)
+        self._pool = None
+        self._pool_pid = None
+        self._lock = threading.Lock()
+        self._bulk = None
+        self._bulk_pid = None
+        self._bulk_lock = threading.Lock()
+
+    def _executor(self):
+        if self._pool is None or self._pool_pid != os.getpid():
+            with self._lock:
+                if self._pool is None or self._pool_pid != os.getpid():
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers)
+                    self._pool_pid = os.getpid()
+        return self._pool
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy()
+        try:
+            return self._executor().submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method, self.salt_length)
+
+    def verify(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    @contextlib.contextmanager
+    def bulk_pool(self, workers=None):
+        """This process's pool for bulk imports, separate from the login pool.
+
+        It is created on first use and kept; one import holds it at a time,
+        and a second one raises HashingBusy instead of waiting or forking
+        another pool.
+        """
+        if not self._bulk_lock.acquire(blocking=False):
+            raise HashingBusy()
+        try:
+            if self._bulk is None or self._bulk_pid != os.getpid():
+                self._bulk = ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1)
+                self._bulk_pid = os.getpid()
+            yield self._bulk
+        finally:
+            self._bulk_lock.release()
+
+    def hash_many(self, passwords, pool):
+        """Hash a batch in ``pool`` (see bulk_pool), bypassing admission control."""
+        passwords = list(passwords)
+        if not passwords:
+            return []
+        chunksize = max(1, len(passwords) // ((os.cpu_count() or 1) * 4))
+        return list(pool.map(
+            generate_password_hash, passwords,
+            [self.method] * len(passwords), [self.salt_length] * len(passwords),
+            chunksize=chunksize
+        ))
+
+    def needs_rehash(self, pwhash):
+        stored_method, _, rest = pwhash.partition('$')
+        salt = rest.partition('$')[0]
+        return stored_method != self.method or len(salt) != self.salt_length
+
+    def shutdown(self):
+        if self._pool is not None and self._pool_pid == os.getpid():
+            self._pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = None
+        if self._bulk is not None and self._bulk_pid == os.getpid():
+            self._bulk.shutdown(wait=False, cancel_futures=True)
+        self._bulk = None
@@ -0,0 +1,293 @@
+"""Load-test harness for my_auth_backend.
+
+Starts the app on a free local port against a throwaway SQLite database,
+seeds it with users, then drives a weighted mix of register / login /
+refresh / protected / users requests from ``--concurrency`` client threads
+for ``--duration`` seconds. Prints per-endpoint throughput and latency
+percentiles and saves them as JSON so runs can be compared:
+
+    python loadtest.py --concurrency 16 --duration 30 --output base.json
+    python loadtest.py --concurrency 16 --duration 30 --compare base.json
+
+Rate limits are lifted for the run; everything else (hashing, pool and
+SQLite settings) comes from the environment as usual, so e.g.
+``AUTH_HASH_WORKERS=4 python loadtest.py`` measures that setting.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+
+import requests
+from werkzeug.security import generate_password_hash
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# Keep in sync with RATE_LIMITS in app.py
+RATE_LIMIT_NAMES = ('login_ip', 'login_account', 'register_ip', 'forgot_password_ip', 'forgot_password_account')
+ENDPOINTS = ('register', 'login', 'refresh', 'protected', 'users')
+DEFAULT_MIX = 'register=5,login=10,refresh=10,protected=45,users=30'
+SEED_PASSWORD = 'loadtest-password'
+
+
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f'unknown endpoint {name!r}')
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(args, db_path, port, log):
+    env = dict(os.environ, AUTH_DATABASE_URL=f'sqlite:///{db_path}', AUTH_PASSWORD_HASH_METHOD=args.hash_method)
+    for name in RATE_LIMIT_NAMES:
+        env[f'AUTH_RATE_{name.upper()}'] = '1000000000/1'
+    if args.server == 'gunicorn':
+        cmd = ['gunicorn', '-w', str(args.workers), '--threads', str(args.threads),
+               '-b', f'127.0.0.1:{port}', 'app:app']
+    else:
+        cmd = [sys.executable, '-m', 'flask', '--app', 'app', 'run', '--no-reload',
+               '--with-threads', '-p', str(port)]
+    proc = subprocess.Popen(cmd, cwd=HERE, env=env, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + args.startup_timeout
+    while time.monotonic() < deadline and proc.poll() is None:
+        try:
+            requests.get(f'http://127.0.0.1:{port}/', timeout=1)
+            return proc
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    proc.terminate()
+    log.seek(0)
+    raise RuntimeError(f'server failed to start:\n{log.read()}')
+
+
+def seed_users(db_path, count, hash_method):
+    # One hash for every row: seeding 10k users shouldn't take 10k KDF runs
+    pwhash = generate_password_hash(SEED_PASSWORD, hash_method)
+    with sqlite3.connect(db_path) as conn:
+        conn.executemany(
+            "INSERT INTO user (username, email, password) VALUES (?, ?, ?)",
+            [(f'seed{i}', f'seed{i}@loadtest.local', pwhash) for i in range(count)]
+        )
+
+
+class VirtualUser:
+    def __init__(self, base_url, seed_users, rng):
+        self.base_url = base_url
+        self.seed_users = seed_users
+        self.rng = rng
+        self.http = requests.Session()
+        self.access_token = None
+        self.refresh_token = None
+
+    def _auth(self, token):
+        return {'Authorization': f'Bearer {token}'}
+
+    def _keep_tokens(self, response):
+        if response.ok:
+            body = response.json()
+            self.access_token = body['access_token']
+            self.refresh_token = body.get('refresh_token', self.refresh_token)
+
+    def register(self):
+        name = f'lt-{uuid.uuid4().hex[:12]}'
+        response = self.http.post(f'{self.base_url}/register', json={
+            'username': name, 'email': f'{name}@loadtest.local', 'password': SEED_PASSWORD
+        })
+        self._keep_tokens(response)
+        return response
+
+    def login(self):
+        n = self.rng.randrange(self.seed_users)
+        response = self.http.post(f'{self.base_url}/login', json={
+            'email': f'seed{n}@loadtest.local', 'password': SEED_PASSWORD
+        })
+        self._keep_tokens(response)
+        return response
+
+    def refresh(self):
+        response = self.http.post(f'{self.base_url}/refresh', headers=self._auth(self.refresh_token))
+        self._keep_tokens(response)
+        return response
+
+    def protected(self):
+        return self.http.get(f'{self.base_url}/protected', headers=self._auth(self.access_token))
+
+    def users(self):
+        after_id = self.rng.randrange(self.seed_users)
+        return self.http.get(f'{self.base_url}/users', params={'after_id': after_id, 'limit': 50},
+                             headers=self._auth(self.access_token))
+
+
+def run_client(base_url, args, mix, seed, started, warmup_until, deadline, results):
+    rng = random.Random(seed)
+    user = VirtualUser(base_url, args.seed_users, rng)
+    latencies = {name: [] for name in ENDPOINTS}
+    statuses = {name: Counter() for name in ENDPOINTS}
+    names, weights = list(mix), list(mix.values())
+    started.wait()
+    while time.monotonic() < deadline:
+        name = rng.choices(names, weights)[0]
+        if user.access_token is None and name != 'register':
+            name = 'login'
+        began = time.perf_counter()
+        try:
+            status = getattr(user, name)().status_code
+        except requests.RequestException as exc:
+            status = type(exc).__name__
+        elapsed = time.perf_counter() - began
+        if time.monotonic() >= warmup_until:
+            latencies[name].append(elapsed)
+            statuses[name][status] += 1
+    results.append((latencies, statuses))
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    return round(values[min(len(values) - 1, int(len(values) * fraction))] * 1000, 2)
+
+
+def summarize(results, seconds):
+    endpoints = {}
+    for name in ENDPOINTS:
+        latencies = sorted(lat for client, _ in results for lat in client[name])
+        statuses = Counter()
+        for _, client in results:
+            statuses.update(client[name])
+        if not latencies:
+            continue
+        ok = sum(count for status, count in statuses.items() if isinstance(status, int) and status < 400)
+        endpoints[name] = {
+            'requests': len(latencies),
+            'ok': ok,
+            'errors': {str(status): count for status, count in statuses.items()
+                       if not (isinstance(status, int) and status < 400)},
+            'rps': round(len(latencies) / seconds, 1),
+            'p50_ms': percentile(latencies, 0.50),
+            'p95_ms': percentile(latencies, 0.95),
+            'p99_ms': percentile(latencies, 0.99),
+        }
+    return endpoints
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(report, baseline=None):
+    header = f"{'endpoint':<10} {'reqs':>7} {'errors':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+    print(header)
+    for name, stats in report['endpoints'].items():
+        line = (f"{name:<10} {stats['requests']:>7} {stats['requests'] - stats['ok']:>7} {stats['rps']:>8} "
+                f"{stats['p50_ms']:>8} {stats['p95_ms']:>8} {stats['p99_ms']:>8}")
+        before = (baseline or {}).get('endpoints', {}).get(name)
+        if before:
+            line += (f"   req/s {_delta(before['rps'], stats['rps'])}"
+                     f"  p95 {_delta(before['p95_ms'], stats['p95_ms'])}")
+        print(line)
+    print(f"total {report['total_rps']} req/s")
+
+
+def _delta(before, after):
+    if not before:
+        return 'n/a'
+    return f'{(after - before) / before * 100:+.1f}%'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test my_auth_backend against a temp database.')
+    parser.add_argument('--concurrency', type=int, default=8, help='client threads')
+    parser.add_argument('--duration', type=float, default=20, help='measured seconds')
+    parser.add_argument('--warmup', type=float, default=3, help='seconds excluded from the results')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f'endpoint weights (default {DEFAULT_MIX})')
+    parser.add_argument('--seed-users', type=int, default=1000)
+    parser.add_argument('--hash-method', default=os.environ.get('AUTH_PASSWORD_HASH_METHOD', 'scrypt'))
+    parser.add_argument('--server', choices=('gunicorn', 'flask'),
+                        default='gunicorn' if shutil.which('gunicorn') else 'flask')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers')
+    parser.add_argument('--threads', type=int, default=8, help='gunicorn threads per worker')
+    parser.add_argument('--startup-timeout', type=float, default=30)
+    parser.add_argument('--output', default=None, help='JSON results file (default loadtest-<timestamp>.json)')
+    parser.add_argument('--compare', default=None, help='earlier JSON results to diff against')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'user.db')
+        port = free_port()
+        base_url = f'http://127.0.0.1:{port}'
+        with open(os.path.join(tmp, 'server.log'), 'w+') as log:
+            server = start_server(args, db_path, port, log)
+            try:
+                seed_users(db_path, args.seed_users, args.hash_method)
+
+                results = []
+                started = threading.Event()
+                warmup_until = time.monotonic() + args.warmup
+                deadline = warmup_until + args.duration
+                clients = [
+                    threading.Thread(target=run_client, args=(
+                        base_url, args, args.mix, i, started, warmup_until, deadline, results))
+                    for i in range(args.concurrency)
+                ]
+                for client in clients:
+                    client.start()
+                started.set()
+                for client in clients:
+                    client.join()
+            finally:
+                server.terminate()
+                server.wait(timeout=10)
+
+    endpoints = summarize(results, args.duration)
+    report = {
+        'started_at': datetime.now(timezone.utc).isoformat(),
+        'git_revision': git_revision(),
+        'python': platform.python_version(),
+        'settings': {
+            'concurrency': args.concurrency, 'duration': args.duration, 'warmup': args.warmup,
+            'mix': args.mix, 'seed_users': args.seed_users, 'hash_method': args.hash_method,
+            'server': args.server, 'workers': args.workers, 'threads': args.threads,
+            'env': {k: v for k, v in os.environ.items() if k.startswith('AUTH_')},
+        },
+        'endpoints': endpoints,
+        'total_rps': round(sum(stats['rps'] for stats in endpoints.values()), 1),
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare) as fh:
+            baseline = json.load(fh)
+    print_report(report, baseline)
+
+    output = args.output or f"loadtest-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    with open(output, 'w') as fh:
+        json.dump(report, fh, indent=2)
+    print(f'results saved to {output}')
+
+
+if __name__ == '__main__':
+    main()
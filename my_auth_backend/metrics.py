@@ -0,0 +1,190 @@
+"""Prometheus text-format metrics for my_auth_backend and backend_chat.
+
+Each service carries an identical copy of this module.
+
+A deliberately small in-process registry: recording a sample is a bisect
+and two additions under a lock, so instrumentation can stay on in
+production. Each process keeps its own numbers (scrape every worker, or
+run one worker per port).
+"""
+import threading
+import time
+from bisect import bisect_left
+
+from flask import g, has_app_context, request
+from sqlalchemy import event
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 1000)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            yield self.name, _labels(self.labels, labels), value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # Per label set: [non-cumulative bucket counts (+Inf last), sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def samples(self):
+        with self._lock:
+            series = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        for labels, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield f'{self.name}_bucket', _labels(self.labels, labels, [('le', _number(bound))]), cumulative
+            yield f'{self.name}_sum', _labels(self.labels, labels), total
+            yield f'{self.name}_count', _labels(self.labels, labels), cumulative
+
+
+class Callback:
+    """Gauge (or counter) read at scrape time from ``fn``.
+
+    ``fn`` returns a number, or a dict of label-value tuples to numbers.
+    """
+
+    def __init__(self, name, help, fn, labels=(), kind='gauge'):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.labels = tuple(labels)
+        self.kind = kind
+
+    def samples(self):
+        value = self.fn()
+        if not isinstance(value, dict):
+            value = {(): value}
+        for labels, number in value.items():
+            yield self.name, _labels(self.labels, labels), number
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name, help, fn, labels=()):
+        return self._add(Callback(name, help, fn, labels))
+
+    def callback_counter(self, name, help, fn, labels=()):
+        return self._add(Callback(name, help, fn, labels, kind='counter'))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+# Database time. Statement time is accumulated on flask.g, so it is
+# attributed to whatever request or Socket.IO event ran the statement.
+
+def track_db_time(engine):
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _started(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics.started', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _finished(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['metrics.started'].pop()
+        if has_app_context():
+            g.db_seconds = g.get('db_seconds', 0.0) + elapsed
+
+
+def reset_db_time():
+    g.db_seconds = 0.0
+
+
+def db_time():
+    return g.get('db_seconds', 0.0)
+
+
+def instrument_app(app, registry, db):
+    """Per-route latency and database-time histograms for ``app``'s HTTP routes."""
+    request_seconds = registry.histogram(
+        'http_request_duration_seconds', 'HTTP request latency by route', ('method', 'route', 'status'))
+    request_db_seconds = registry.histogram(
+        'http_request_db_seconds', 'Database statement time per HTTP request', ('route',))
+
+    with app.app_context():
+        for engine in db.engines.values():
+            track_db_time(engine)
+
+    @app.before_request
+    def _start_request_timer():
+        g.request_started = time.perf_counter()
+        reset_db_time()
+
+    @app.after_request
+    def _observe_request(response):
+        started = g.pop('request_started', None)
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            request_seconds.observe(time.perf_counter() - started, request.method, route, response.status_code)
+            request_db_seconds.observe(db_time(), route)
+        return response
@@ -0,0 +1,154 @@
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+
+def parse_rate(spec):
+    """``"10/60"`` -> (capacity 10, refill 10/60 tokens per second)."""
+    count, _, seconds = spec.partition('/')
+    count = float(count)
+    return count, count / float(seconds or 1)
+
+
+class MemoryBackend:
+    """Token buckets in this process only."""
+
+    MAX_KEYS = 100000
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, refill, now):
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * refill)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.MAX_KEYS:
+                self._prune(now)
+            return allowed, 0 if allowed else (1 - tokens) / refill
+
+    def _prune(self, now):
+        # Buckets idle long enough to have refilled carry no state worth keeping
+        for key, (tokens, updated) in list(self._buckets.items()):
+            if now - updated > 3600:
+                del self._buckets[key]
+
+
+class SqliteBackend:
+    """Token buckets in a SQLite file shared by every worker on the host."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rate_bucket "
+                "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def take(self, key, capacity, refill, now):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM rate_bucket WHERE key = ?", (key,)).fetchone()
+            tokens, updated = row if row else (capacity, now)
+            tokens = min(capacity, tokens + (now - updated) * refill)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_bucket (key, tokens, updated) VALUES (?, ?, ?)",
+                (key, tokens, now)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return allowed, 0 if allowed else (1 - tokens) / refill
+
+
+class RateLimiter:
+    """Named token-bucket limits checked per key (client IP, account, ...)."""
+
+    def __init__(self, backend=None, clock=time.time):
+        self.backend = backend or MemoryBackend()
+        self.clock = clock
+        self.limits = {}
+        self.stats = Counter()
+
+    def configure(self, name, spec):
+        self.limits[name] = parse_rate(spec)
+
+    def check(self, name, key):
+        """Returns seconds to wait, or 0 when the request may proceed."""
+        if name not in self.limits or key is None:
+            return 0
+        capacity, refill = self.limits[name]
+        allowed, retry_after = self.backend.take(f"{name}:{key}", capacity, refill, self.clock())
+        self.stats[f"{name}.{'allowed' if allowed else 'limited'}"] += 1
+        return retry_after
+
+
+class FailureCache:
+    """Short-lived record of failed logins per key.
+
+    Once a key collects ``threshold`` failures within ``ttl`` seconds it is
+    rejected outright until the window passes, before any query or hash runs.
+    Callers can pass a different threshold per lookup for broader keys.
+    """
+
+    MAX_KEYS = 100000
+
+    def __init__(self, threshold=5, ttl=300, clock=time.time):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.clock = clock
+        self._failures = {}
+        self._lock = threading.Lock()
+        self.stats = Counter()
+
+    def blocked_for(self, key, threshold=None):
+        if key is None:
+            return 0
+        with self._lock:
+            entry = self._failures.get(key)
+            now = self.clock()
+            if entry and now - entry[1] >= self.ttl:
+                del self._failures[key]
+                entry = None
+            if entry and entry[0] >= (threshold or self.threshold):
+                self.stats['hits'] += 1
+                return entry[1] + self.ttl - now
+            self.stats['misses'] += 1
+            return 0
+
+    def record(self, key):
+        if key is None:
+            return
+        with self._lock:
+            now = self.clock()
+            count, first = self._failures.get(key, (0, now))
+            if now - first >= self.ttl:
+                count, first = 0, now
+            self._failures[key] = (count + 1, first)
+            if len(self._failures) > self.MAX_KEYS:
+                for stale, (_, started) in list(self._failures.items()):
+                    if now - started >= self.ttl:
+                        del self._failures[stale]
+
+    def clear(self, key):
+        with self._lock:
+            self._failures.pop(key, None)
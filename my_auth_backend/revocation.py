@@ -0,0 +1,121 @@
+import hashlib
+import logging
+import math
+import threading
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import select
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings (double hashing on one BLAKE2b digest)."""
+
+    def __init__(self, capacity=100000, error_rate=0.01):
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for pos in self._positions(item):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item):
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+
+class RevocationStore:
+    """Revoked token ids in SQLite, fronted by a per-worker Bloom filter.
+
+    A token whose jti is not in the filter is known-good without any I/O,
+    which is every token in the common case; filter hits are confirmed
+    against the table. Each worker pulls revocations made by other workers
+    every ``sync_interval`` seconds with one indexed query, so a revocation
+    reaches all workers within that interval. Use ``strict=True`` where that
+    lag matters (refresh-token rotation).
+    """
+
+    def __init__(self, db, model, sync_interval=1.0, prune_interval=3600, capacity=100000,
+                 clock=time.monotonic):
+        self.db = db
+        self.model = model
+        self.sync_interval = sync_interval
+        self.prune_interval = prune_interval
+        self.capacity = capacity
+        self.clock = clock
+        self._bloom = BloomFilter(capacity)
+        self._last_id = 0
+        self._synced_at = None
+        self._pruned_at = clock()
+        self._revoked_during_prune = None
+        self._lock = threading.Lock()
+
+    def revoke(self, jti, expires_at):
+        """Persist a revocation (caller commits) and apply it locally right away."""
+        self.db.session.add(self.model(jti=jti, expires_at=expires_at))
+        self._bloom.add(jti)
+        if self._revoked_during_prune is not None:
+            self._revoked_during_prune.append(jti)
+
+    def is_revoked(self, jti, strict=False):
+        self._maybe_sync()
+        if not strict and jti not in self._bloom:
+            return False
+        return self.db.session.query(self.model.id).filter_by(jti=jti).first() is not None
+
+    def _maybe_sync(self):
+        now = self.clock()
+        if self._synced_at is not None and now - self._synced_at < self.sync_interval:
+            return
+        with self._lock:
+            if self._synced_at is not None and now - self._synced_at < self.sync_interval:
+                return
+            if now - self._pruned_at >= self.prune_interval:
+                self._pruned_at = now
+                self._revoked_during_prune = []
+                self._start_prune()
+            rows = self.db.session.query(self.model.id, self.model.jti).filter(
+                self.model.id > self._last_id
+            ).order_by(self.model.id).all()
+            for row_id, jti in rows:
+                self._bloom.add(jti)
+                self._last_id = row_id
+            self._synced_at = now
+
+    def _start_prune(self):
+        # Own connection and thread: this runs during requests (the JWT blocklist
+        # check, /logout), whose session must not be committed or kept waiting
+        # on the write lock.
+        threading.Thread(target=self._prune, args=(self.db.engine,), name='revocation-prune', daemon=True).start()
+
+    def _prune(self, engine):
+        # Expired tokens are rejected by signature checks anyway; drop their rows
+        # and rebuild the filter so it doesn't fill up over time.
+        table = self.model.__table__
+        try:
+            with engine.begin() as conn:
+                conn.execute(table.delete().where(table.c.expires_at < datetime.now(timezone.utc)))
+                rows = conn.execute(select(table.c.id, table.c.jti).order_by(table.c.id)).all()
+        except Exception:
+            self._revoked_during_prune = None
+            logger.exception("Pruning revoked tokens failed")
+            return
+        bloom = BloomFilter(self.capacity)
+        for _, jti in rows:
+            bloom.add(jti)
+        with self._lock:
+            # Local revocations may not have been committed when the rows were
+            # read; others committed after the read are picked up by the next sync
+            for jti in self._revoked_during_prune or ():
+                bloom.add(jti)
+            self._revoked_during_prune = None
+            self._bloom = bloom
+            self._last_id = rows[-1].id if rows else 0